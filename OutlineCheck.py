@@ -1,14 +1,26 @@
+import os
 import sys
+import math
+import time
+import bisect
 import numpy as np
 from PIL import Image
 from PyQt6.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, 
-    QPushButton, QTreeWidget, QTreeWidgetItem, QLabel, QFileDialog, 
+    QPushButton, QTreeView, QLabel, QFileDialog, 
     QFrame, QSplitter, QScrollArea, QAbstractItemView, QColorDialog,
-    QComboBox
+    QComboBox, QProgressBar, QSpinBox, QListWidget, QListWidgetItem
 )
+from PyQt6 import sip
 from PyQt6.QtGui import QPixmap, QImage, QPainter, QColor, QShortcut, QKeySequence, QWheelEvent, QMouseEvent, QKeyEvent, QIcon, QPen, QBrush
-from PyQt6.QtCore import Qt, QPoint, pyqtSignal, QSize, QTimer
+from PyQt6.QtCore import (
+    Qt, QPoint, QPointF, QRect, QRectF, pyqtSignal, QSize, QTimer, QObject, QThread,
+    QAbstractItemModel, QModelIndex, QItemSelection, QItemSelectionModel
+)
+from OutlineCheckCore import (
+    CATEGORY_COLORS, CATEGORY_KEYS, CATEGORY_NAMES, PROFILER, AnalysisCache, AnalysisCancelled, OutlineAnalysis,
+    CellCache, PixelHistory, analyze_frames, default_cache_dir, load_frames
+)
 
 LANGUAGES = {
     "FR": {
@@ -26,7 +38,21 @@ LANGUAGES = {
         "brush_mode": "Mode Pinceau",
         "choose_color": "Choisir une couleur",
         "toggle_outline_on": "VOIR: COULEURS CONTOUR",
-        "toggle_outline_off": "VOIR: TOUTES COULEURS"
+        "toggle_outline_off": "VOIR: TOUTES COULEURS",
+        "cell_size": "CELLULE DE PLANCHE",
+        "cell_off": "Désactivé",
+        "history_status": "Historique : {steps} étapes, {size:.1f} Mo",
+        "cancel": "Annuler",
+        "cache_status": "Cache d'analyse : {hits} succès, {misses} échecs",
+        "fix_all_frames": "CORRIGER DANS TOUTES LES IMAGES",
+        "fix_all": "TOUT CORRIGER",
+        "fix_all_status": "Correction auto : {pixels} pixels en {iterations} passes, {remaining} erreurs restantes ({ms:.0f} ms)",
+        "frame_label": "Image {index} : {errors} erreurs",
+        "region_header": "SÉLECTION PAR ZONE",
+        "same_color": "Couleur",
+        "same_color_tip": "Seulement les erreurs de la couleur du pixel où la zone commence",
+        "region_status": "{count} erreurs sélectionnées ({ms:.0f} ms)",
+        "save_trace": "Enregistrer la trace de profilage"
     },
     "EN": {
         "title": "OUTLINECHECK",
@@ -43,25 +69,88 @@ LANGUAGES = {
         "brush_mode": "Brush Mode",
         "choose_color": "Pick a color",
         "toggle_outline_on": "VIEW: OUTLINE COLORS",
-        "toggle_outline_off": "VIEW: ALL COLORS"
+        "toggle_outline_off": "VIEW: ALL COLORS",
+        "cell_size": "SPRITE SHEET CELL",
+        "cell_off": "Off",
+        "history_status": "History: {steps} steps, {size:.1f} MB",
+        "cancel": "Cancel",
+        "cache_status": "Analysis cache: {hits} hits, {misses} misses",
+        "fix_all_frames": "FIX IN ALL FRAMES",
+        "fix_all": "FIX ALL",
+        "fix_all_status": "Auto-fix: {pixels} pixels in {iterations} passes, {remaining} errors left ({ms:.0f} ms)",
+        "frame_label": "Frame {index}: {errors} errors",
+        "region_header": "REGION SELECTION",
+        "same_color": "Colour",
+        "same_color_tip": "Only the errors of the colour of the pixel where the region starts",
+        "region_status": "{count} errors selected ({ms:.0f} ms)",
+        "save_trace": "Save profiling trace"
     }
 }
 
+def premultiplied_argb(color):
+    a = color.alpha()
+    r, g, b = ((c * a + 127) // 255 for c in (color.red(), color.green(), color.blue()))
+    return (a << 24) | (r << 16) | (g << 8) | b
+
+# Edits touching more pixels than this are re-analyzed in full (and looked up in the
+# analysis cache) rather than patched in place.
+INCREMENTAL_EDIT_LIMIT = 4096
+
+SELECTED_ARGB = premultiplied_argb(QColor(0, 200, 255, 200))
+CATEGORY_ARGB = np.array([premultiplied_argb(QColor(*CATEGORY_COLORS[key], 255)) for key in CATEGORY_KEYS], dtype=np.uint32)
+
+def rgba_view(pixels):
+    # QImage over a contiguous (h, w, 4) uint8 array, sharing its memory: writes to the
+    # array show up on the next paint. The caller keeps the array alive.
+    h, w = pixels.shape[:2]
+    return QImage(sip.voidptr(pixels.ctypes.data), w, h, pixels.strides[0], QImage.Format.Format_RGBA8888)
+
+def layer_states(states, lids):
+    # states[lids] for a boolean array indexed by layer id, False past its end.
+    out = np.zeros(len(lids), dtype=bool)
+    inside = lids < len(states)
+    out[inside] = states[lids[inside]]
+    return out
+
+def line_points(x0, y0, x1, y1):
+    # Bresenham line from (x0, y0) to (x1, y1), both ends included.
+    points = []
+    dx, dy = abs(x1 - x0), -abs(y1 - y0)
+    sx, sy = (1 if x1 > x0 else -1), (1 if y1 > y0 else -1)
+    err = dx + dy
+    while True:
+        points.append((x0, y0))
+        if x0 == x1 and y0 == y1:
+            return points
+        e2 = 2 * err
+        if e2 >= dy:
+            err += dy
+            x0 += sx
+        if e2 <= dx:
+            err += dx
+            y0 += sy
+
 class PixelCanvas(QWidget):
     pixelSelected = pyqtSignal(int, bool)
     colorPicked = pyqtSignal(QColor)
     brushPainted = pyqtSignal(int, int)
+    strokeFinished = pyqtSignal()
+    # (kind, points, add): "rect" with the start and end points of the drag or "lasso" with
+    # its polygon, [(x, y), ...] in image coordinates. add: Ctrl was held.
+    regionSelected = pyqtSignal(str, object, bool)
     def __init__(self):
         super().__init__()
         self.setMouseTracking(True)
         self.setFocusPolicy(Qt.FocusPolicy.StrongFocus)
         
-        self.original_pixmap = None
+        self.pixels = None
+        self.image = None
         self.zoom = 6.0
-        self.error_map = {} 
-        self.visible_layers = set()
-        self.selected_layers = set()
-        self.layers = []
+        self.errors = None
+        self.visible_layers = np.zeros(0, dtype=bool)
+        self.selected_layers = np.zeros(0, dtype=bool)
+        self.overlay_np = None
+        self.overlay_image = None
         
         self.offset_x = 0.0
         self.offset_y = 0.0
@@ -72,65 +161,109 @@ class PixelCanvas(QWidget):
         
         self.picker_mode = False
         self.brush_mode = False
+        # None, "rect" or "lasso": left drags select the errors inside a region.
+        self.select_mode = None
         self.space_pressed = False
         self.last_mouse_pos = QPoint()
-
-    def set_image(self, pixmap, error_map=None, reset_view=True):
-        self.original_pixmap = pixmap
-        self.error_map = error_map if error_map is not None else {}
+        self.last_brush_pos = None
+        # Image coordinates of the region being dragged: its two corners or the lasso path.
+        self.band = []
+        self.band_add = False
+
+    def set_image(self, pixels, errors=None, reset_view=True):
+        # pixels: (h, w, 4) RGBA buffer shown through a view, not copied; later writes to it
+        # only need invalidate_pixels(). errors: ErrorTable of the image, or None.
+        if pixels is not self.pixels:
+            self.pixels = pixels
+            self.image = rgba_view(pixels)
+        self.errors = errors
+        self.invalidate_overlay()
         if reset_view:
             self.offset_x = 0.0
             self.offset_y = 0.0
         self.update()
-    
-    def set_layers(self, layers):
-        self.layers = layers
-
-    def get_layer_color(self, layer_id):
-        if layer_id < len(self.layers):
-            layer = self.layers[layer_id]
-            if layer.category_color:
-                color = layer.category_color
-                return QColor(color.red(), color.green(), color.blue(), 255)
-        return QColor(0, 0, 0, 150)
+
+    def set_layer_states(self, visible, selected, lids=None):
+        # visible / selected: boolean arrays indexed by layer id, kept by reference. After
+        # changing some of their entries in place, update_layers() repaints those layers.
+        # lids: the only layers that differ from the previous arrays, patched instead of
+        # rebuilding the overlay (errors added to, removed from or changed in the table).
+        self.visible_layers = visible
+        self.selected_layers = selected
+        if lids is None:
+            self.invalidate_overlay()
+            self.update()
+        else:
+            self.update_layers(lids)
+
+    def update_layers(self, lids):
+        # Patches the overlay at the error points of lids and repaints their bounding rectangle,
+        # in time proportional to len(lids).
+        if self.errors is None or not len(lids):
+            return
+        if self.overlay_image is None:
+            self.update()
+            return
+        xs, ys = self.errors.x[lids], self.errors.y[lids]
+        self.paint_overlay(np.stack([xs, ys, lids], axis=1))
+        self.invalidate_pixels(xs.min(), ys.min(), xs.max() - xs.min() + 1, ys.max() - ys.min() + 1)
+
+    def invalidate_overlay(self):
+        self.overlay_image = None
+
+    def paint_overlay(self, points):
+        # Writes the overlay pixels of error points [(x, y, lid)]: the selection colour, the
+        # category colour, or nothing for hidden or removed layers.
+        if not len(points):
+            return
+        xs, ys, lids = points.T
+        colors = np.where(layer_states(self.selected_layers, lids), SELECTED_ARGB, CATEGORY_ARGB[self.errors.category[lids]])
+        shown = layer_states(self.visible_layers, lids) & self.errors.live[lids]
+        self.overlay_np[ys, xs] = np.where(shown, colors, 0)
+
+    def overlay(self):
+        # Error overlay as one premultiplied ARGB32 buffer, rebuilt after set_image and
+        # set_layer_states, patched by update_layers. Blended over the image when painted.
+        if self.overlay_image is None:
+            h, w = self.pixels.shape[:2]
+            self.overlay_np = np.zeros((h, w), dtype=np.uint32)
+            if self.errors is not None:
+                lids = self.errors.live_ids()
+                self.paint_overlay(np.stack([self.errors.x[lids], self.errors.y[lids], lids], axis=1).astype(np.intp))
+            self.overlay_image = QImage(self.overlay_np.data, w, h, w * 4, QImage.Format.Format_ARGB32_Premultiplied)
+        return self.overlay_image
 
     def paintEvent(self, event):
-        if not self.original_pixmap:
+        if self.image is None:
             return
         
-        painter = QPainter(self)
-        painter.fillRect(self.rect(), QColor(30, 30, 30))
-        
-        temp_pixmap = self.original_pixmap.copy()
-        
-        if self.error_map:
-            temp_painter = QPainter(temp_pixmap)
-            for (x, y), layer_ids in self.error_map.items():
-                for lid in layer_ids:
-                    if lid in self.visible_layers:
-                        color = self.get_layer_color(lid)
-                        if lid in self.selected_layers:
-                            color = QColor(0, 200, 255, 200) 
-                        temp_painter.fillRect(x, y, 1, 1, color)
-            temp_painter.end()
-        
-        img_width = int(temp_pixmap.width() * self.zoom)
-        img_height = int(temp_pixmap.height() * self.zoom)
-        screen_x = int(-self.offset_x * self.zoom)
-        screen_y = int(-self.offset_y * self.zoom)
+        with PROFILER.phase("paint"):
+            painter = QPainter(self)
+            painter.fillRect(self.rect(), QColor(30, 30, 30))
         
-        white_bg = QColor(225, 225, 225)
-        painter.fillRect(screen_x, screen_y, img_width, img_height, white_bg)
-        
-        scaled_size = temp_pixmap.size() * self.zoom
-        scaled_pixmap = temp_pixmap.scaled(
-            scaled_size,
-            Qt.AspectRatioMode.KeepAspectRatio,
-            Qt.TransformationMode.FastTransformation
-        )
-        
-        painter.drawPixmap(screen_x, screen_y, scaled_pixmap)
-        painter.end()
+            # Only the source pixels under the viewport are scaled, straight onto the widget.
+            x0 = max(math.floor(self.offset_x), 0)
+            y0 = max(math.floor(self.offset_y), 0)
+            x1 = min(math.ceil(self.offset_x + self.width() / self.zoom), self.image.width())
+            y1 = min(math.ceil(self.offset_y + self.height() / self.zoom), self.image.height())
+            if x1 > x0 and y1 > y0:
+                target = QRectF((x0 - self.offset_x) * self.zoom, (y0 - self.offset_y) * self.zoom,
+                                (x1 - x0) * self.zoom, (y1 - y0) * self.zoom)
+                source = QRectF(x0, y0, x1 - x0, y1 - y0)
+                white_bg = QColor(225, 225, 225)
+                painter.fillRect(target, white_bg)
+                painter.drawImage(target, self.image, source)
+                if self.errors is not None and len(self.errors):
+                    painter.drawImage(target, self.overlay(), source)
+            if self.band:
+                points = [QPointF((x - self.offset_x) * self.zoom, (y - self.offset_y) * self.zoom) for x, y in self.band]
+                for color, style in ((Qt.GlobalColor.black, Qt.PenStyle.SolidLine), (Qt.GlobalColor.white, Qt.PenStyle.DashLine)):
+                    painter.setPen(QPen(color, 1, style))
+                    if self.select_mode == "rect":
+                        painter.drawRect(QRectF(points[0], points[-1]).normalized())
+                    else:
+                        painter.drawPolygon(points)
+            painter.end()
 
     def wheelEvent(self, event: QWheelEvent):
         delta = event.angleDelta().y()
@@ -165,20 +298,29 @@ class PixelCanvas(QWidget):
         y = int(event.position().y() / self.zoom + self.offset_y)
 
         if self.picker_mode:
-            if self.original_pixmap:
-                img = self.original_pixmap.toImage()
-                if 0 <= x < img.width() and 0 <= y < img.height():
-                    self.colorPicked.emit(img.pixelColor(x, y))
+            if self.pixels is not None:
+                h, w = self.pixels.shape[:2]
+                if 0 <= x < w and 0 <= y < h:
+                    self.colorPicked.emit(QColor(*self.pixels[y, x].tolist()))
             return
             
         if self.brush_mode:
+            self.last_brush_pos = (x, y)
             self.brushPainted.emit(x, y)
             return
 
+        if self.select_mode and event.button() == Qt.MouseButton.LeftButton:
+            point = self.image_point(event)
+            self.band = [point, point]
+            self.band_add = bool(event.modifiers() & Qt.KeyboardModifier.ControlModifier)
+            self.update()
+            return
+
         if event.button() == Qt.MouseButton.LeftButton:
-            if (x, y) in self.error_map:
+            lid = self.errors.at(x, y) if self.errors is not None else -1
+            if lid >= 0:
                 add_to_selection = bool(event.modifiers() & Qt.KeyboardModifier.ControlModifier)
-                self.pixelSelected.emit(self.error_map[(x, y)][0], add_to_selection)
+                self.pixelSelected.emit(lid, add_to_selection)
 
     def mouseMoveEvent(self, event: QMouseEvent):
             if self.is_dragging:
@@ -187,25 +329,410 @@ class PixelCanvas(QWidget):
                 self.offset_y = self.drag_offset_start[1] - delta.y() / self.zoom
                 self.update()
                 return
+
+            if self.band:
+                point = self.image_point(event)
+                if self.select_mode == "rect":
+                    self.band[-1] = point
+                elif math.dist(point, self.band[-1]) * self.zoom >= 3:
+                    # Lasso vertices at least 3 screen pixels apart.
+                    self.band.append(point)
+                self.update()
+                return
                 
             if self.brush_mode and event.buttons() & Qt.MouseButton.LeftButton:
                 x = int(event.position().x() / self.zoom + self.offset_x)
                 y = int(event.position().y() / self.zoom + self.offset_y)
-                self.brushPainted.emit(x, y)
+                if self.last_brush_pos is None:
+                    self.last_brush_pos = (x, y)
+                    self.brushPainted.emit(x, y)
+                elif (x, y) != self.last_brush_pos:
+                    # Fast strokes skip pixels between two move events, fill the gap.
+                    for px, py in line_points(*self.last_brush_pos, x, y)[1:]:
+                        self.brushPainted.emit(px, py)
+                    self.last_brush_pos = (x, y)
 
     def mouseReleaseEvent(self, event: QMouseEvent):
         self.is_dragging = False
+        if self.last_brush_pos is not None:
+            self.last_brush_pos = None
+            self.strokeFinished.emit()
+        if self.band:
+            band, self.band = self.band, []
+            self.update()
+            self.regionSelected.emit(self.select_mode, band, self.band_add)
+
+    def image_point(self, event):
+        # Mouse position in image coordinates, not rounded to a pixel.
+        return (event.position().x() / self.zoom + self.offset_x, event.position().y() / self.zoom + self.offset_y)
+
+    def invalidate_pixels(self, x, y, w=1, h=1):
+        # Repaints the widget area of source pixels that were written to self.pixels.
+        left = math.floor((x - self.offset_x) * self.zoom)
+        top = math.floor((y - self.offset_y) * self.zoom)
+        right = math.ceil((x + w - self.offset_x) * self.zoom)
+        bottom = math.ceil((y + h - self.offset_y) * self.zoom)
+        self.update(QRect(left, top, right - left, bottom - top))
+
+class AnalysisWorker(QObject):
+    # Runs full analyses off the GUI thread. A request is abandoned as soon as
+    # latest_generation no longer matches it (newer edit or cancellation). Results are
+    # cached by pixel content, so re-opened images and undone states come back at once.
+    progress = pyqtSignal(int, int)
+    finished = pyqtSignal(int, object)
+    framesFinished = pyqtSignal(int, object)
+    fixAllFinished = pyqtSignal(int, object)
+
+    def __init__(self):
+        super().__init__()
+        self.latest_generation = 0
+        # Analyses are cached in memory for the session; OUTLINECHECK_DISK_CACHE=1 also keeps
+        # them in default_cache_dir() for later sessions.
+        disk_cache = os.environ.get("OUTLINECHECK_DISK_CACHE", "") not in ("", "0")
+        self.cache = AnalysisCache(cache_dir=default_cache_dir() if disk_cache else None)
+        self.cell_cache = CellCache()
+
+    def run(self, generation, img_np, cell_size):
+        # Requests queued behind a newer one are dropped before any hashing is done.
+        if generation != self.latest_generation:
+            return
+        def report(fraction):
+            if generation != self.latest_generation:
+                raise AnalysisCancelled()
+            self.progress.emit(generation, int(fraction * 100))
+        try:
+            if cell_size:
+                analysis = self.cache.analyze(img_np, report, tile_size=cell_size, cell_cache=self.cell_cache)
+            else:
+                analysis = self.cache.analyze(img_np, report)
+        except AnalysisCancelled:
+            return
+        self.finished.emit(generation, analysis)
 
-class ErrorLayer:
-    def __init__(self, id, x, y, color_key, category="OT", category_color=None):
-        self.id = id
-        self.x = x
-        self.y = y
-        self.color_key = color_key
-        self.category = category
-        self.category_color = category_color
+    def run_frames(self, generation, frames, cell_size):
+        if generation != self.latest_generation:
+            return
+        def report(fraction):
+            if generation != self.latest_generation:
+                raise AnalysisCancelled()
+            self.progress.emit(generation, int(fraction * 100))
+        kwargs = {"tile_size": cell_size, "cell_cache": self.cell_cache} if cell_size else {}
+        try:
+            analyses = analyze_frames(frames, report, self.cache, **kwargs)
+        except AnalysisCancelled:
+            return
+        self.framesFinished.emit(generation, analyses)
+
+    def run_fix_all(self, generation, analysis, categories, fill_color, cell_size):
+        # analysis is a copy of the GUI's, fixed in place; a cancelled one is just dropped.
+        if generation != self.latest_generation:
+            return
+        def report(fraction):
+            if generation != self.latest_generation:
+                raise AnalysisCancelled()
+            self.progress.emit(generation, int(fraction * 100))
+        kwargs = {"tile_size": cell_size, "cell_cache": self.cell_cache} if cell_size else {}
+        try:
+            edits, summary = analysis.fix_all(categories, fill_color, progress=report, **kwargs)
+        except AnalysisCancelled:
+            return
+        self.fixAllFinished.emit(generation, (analysis, edits, summary))
+
+class AnimationFrame:
+    # One frame of the open document with its own undo history and analysis.
+    def __init__(self, pixels, duration=100):
+        self.pixels = pixels
+        self.duration = duration
+        self.history = PixelHistory()
+        self.analysis = OutlineAnalysis()
+        self.analysis_in_sync = False
+
+class ColorGroup:
+    def __init__(self, color, lids):
+        self.color = color
+        self.lids = lids
+        self.row = 0
+        self.selected = False
+        self.icon = None
+        self._lid_array = None
+
+    def lid_array(self):
+        # lids as an index array, kept until the rows change (see changed()).
+        if self._lid_array is None:
+            self._lid_array = np.array(self.lids, dtype=np.intp)
+        return self._lid_array
+
+    def changed(self):
+        self._lid_array = None
+
+class ErrorTreeModel(QAbstractItemModel):
+    # Colour groups with their error layers as children. Rows are built on demand by the
+    # view; check, selection and visibility state are arrays indexed by layer id, so the
+    # canvas masks never need a walk over the tree. Layer id -> row (layer_index) and
+    # colour -> group (group_by_color) are kept up to date by reset_layers and apply_diff.
+    # checkStateChanged carries the ids of the layers whose check state changed.
+    checkStateChanged = pyqtSignal(object)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.errors = None
+        self.groups = []
+        self.group_by_color = {}
+        self.layer_group = []
+        self.layer_row = np.zeros(0, dtype=np.int32)
+        self.checked = np.zeros(0, dtype=bool)
+        self.selected = np.zeros(0, dtype=bool)
+        # Shown on the canvas: checked, or in a selected group.
+        self.visible = np.zeros(0, dtype=bool)
+        self.category_icons = {}
+
+    def index(self, row, column, parent=QModelIndex()):
+        # Bounds checked here rather than by hasIndex(), which calls back into rowCount and
+        # columnCount for each of the many indexes a large selection asks for.
+        if column != 0 or row < 0:
+            return QModelIndex()
+        if not parent.isValid():
+            return self.createIndex(row, 0, None) if row < len(self.groups) else QModelIndex()
+        if parent.internalPointer() is not None or parent.row() >= len(self.groups):
+            return QModelIndex()
+        group = self.groups[parent.row()]
+        return self.createIndex(row, 0, group) if row < len(group.lids) else QModelIndex()
+
+    def parent(self, index=None):
+        if index is None:
+            return super().parent()
+        group = index.internalPointer() if index.isValid() else None
+        if group is None:
+            return QModelIndex()
+        return self.createIndex(group.row, 0, None)
+
+    def rowCount(self, parent=QModelIndex()):
+        if not parent.isValid():
+            return len(self.groups)
+        if parent.internalPointer() is None:
+            return len(self.groups[parent.row()].lids)
+        return 0
+
+    def columnCount(self, parent=QModelIndex()):
+        return 1
+
+    # Queried for every row the view lays out, so the flag combinations are built once.
+    GROUP_FLAGS = Qt.ItemFlag.ItemIsEnabled | Qt.ItemFlag.ItemIsSelectable
+    LAYER_FLAGS = GROUP_FLAGS | Qt.ItemFlag.ItemIsUserCheckable
+
+    def flags(self, index):
+        if not index.isValid():
+            return Qt.ItemFlag.NoItemFlags
+        return self.GROUP_FLAGS if index.internalPointer() is None else self.LAYER_FLAGS
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        group = index.internalPointer()
+        if group is None:
+            group = self.groups[index.row()]
+            if role == Qt.ItemDataRole.DisplayRole:
+                color_hex = '#%02x%02x%02x' % tuple(int(c) for c in group.color[:3])
+                return f"{color_hex} ({len(group.lids)})"
+            if role == Qt.ItemDataRole.DecorationRole:
+                if group.icon is None:
+                    pix = QPixmap(16, 16)
+                    pix.fill(QColor(*(int(c) for c in group.color)))
+                    group.icon = QIcon(pix)
+                return group.icon
+            if role == Qt.ItemDataRole.UserRole + 1:
+                return group.color
+            return None
+        lid = group.lids[index.row()]
+        if role == Qt.ItemDataRole.DisplayRole:
+            category = self.errors.category_of(lid)
+            return f"{CATEGORY_NAMES.get(category, category)} {lid} ({self.errors.x[lid]}, {self.errors.y[lid]})"
+        if role == Qt.ItemDataRole.DecorationRole:
+            return self.category_icon(self.errors.category_of(lid))
+        if role == Qt.ItemDataRole.CheckStateRole:
+            return Qt.CheckState.Checked if self.checked[lid] else Qt.CheckState.Unchecked
+        if role == Qt.ItemDataRole.UserRole:
+            return lid
+        return None
+
+    def setData(self, index, value, role=Qt.ItemDataRole.EditRole):
+        if role != Qt.ItemDataRole.CheckStateRole or index.internalPointer() is None:
+            return False
+        group = index.internalPointer()
+        lid = group.lids[index.row()]
+        self.checked[lid] = Qt.CheckState(value) == Qt.CheckState.Checked
+        self.visible[lid] = self.checked[lid] or group.selected
+        self.dataChanged.emit(index, index, [role])
+        self.checkStateChanged.emit(np.array([lid]))
+        return True
+
+    def category_icon(self, category):
+        icon = self.category_icons.get(category)
+        if icon is None:
+            pix = QPixmap(12, 12)
+            pix.fill(QColor(*CATEGORY_COLORS[category]))
+            icon = self.category_icons[category] = QIcon(pix)
+        return icon
+
+    def group_index(self, group):
+        return self.createIndex(group.row, 0, None)
+
+    def layer_index(self, lid):
+        group = self.layer_group[lid] if lid < len(self.layer_group) else None
+        if group is None:
+            return QModelIndex()
+        return self.createIndex(int(self.layer_row[lid]), 0, group)
+
+    def _resize(self, n):
+        grow = n - len(self.checked)
+        if grow > 0:
+            self.layer_row = np.concatenate([self.layer_row, np.full(grow, -1, dtype=np.int32)])
+            self.checked = np.concatenate([self.checked, np.zeros(grow, dtype=bool)])
+            self.selected = np.concatenate([self.selected, np.zeros(grow, dtype=bool)])
+            self.visible = np.concatenate([self.visible, np.zeros(grow, dtype=bool)])
+            self.layer_group.extend([None] * grow)
+
+    def _renumber(self, first=0):
+        for row in range(first, len(self.groups)):
+            self.groups[row].row = row
+
+    def reset_layers(self, errors):
+        self.beginResetModel()
+        self.errors = errors
+        n = len(errors)
+        lids = errors.live_ids()
+        color_order = sorted(range(len(errors.colors)), key=errors.colors.__getitem__)
+        color_rank = np.zeros(len(errors.colors), dtype=np.intp)
+        color_rank[color_order] = np.arange(len(color_order))
+        ranks = color_rank[errors.color_index[lids]]
+        order = np.argsort(ranks, kind="stable")
+        lids, ranks = lids[order], ranks[order]
+        bounds = np.flatnonzero(np.diff(ranks)) + 1
+        self.groups = [ColorGroup(errors.color_of(members[0]), members.tolist())
+                       for members in np.split(lids, bounds) if len(members)]
+        self.group_by_color = {group.color: group for group in self.groups}
+        self.layer_group = [None] * n
+        self.layer_row = np.full(n, -1, dtype=np.int32)
+        self.checked = np.zeros(n, dtype=bool)
+        self.selected = np.zeros(n, dtype=bool)
+        self.visible = np.zeros(n, dtype=bool)
+        self._renumber()
+        for group in self.groups:
+            self.layer_row[group.lids] = np.arange(len(group.lids))
+            for lid in group.lids:
+                self.layer_group[lid] = group
+        self.endResetModel()
+
+    def apply_diff(self, added, removed, changed):
+        # Patches the rows touched by OutlineAnalysis.update(); the rest of the tree,
+        # including check and selection state, is left alone. Returns the groups still in
+        # the tree whose rows changed.
+        self._resize(len(self.errors))
+        touched = set()
+
+        removed_by_group = {}
+        for lid in removed:
+            removed_by_group.setdefault(self.layer_group[lid], []).append(int(self.layer_row[lid]))
+        for group, rows in removed_by_group.items():
+            rows.sort()
+            parent = self.group_index(group)
+            end = len(rows)
+            while end > 0:
+                start = end - 1
+                while start > 0 and rows[start - 1] == rows[start] - 1:
+                    start -= 1
+                self.beginRemoveRows(parent, rows[start], rows[end - 1])
+                del group.lids[rows[start]:rows[end - 1] + 1]
+                group.changed()
+                self.endRemoveRows()
+                end = start
+            self.layer_row[group.lids] = np.arange(len(group.lids))
+            touched.add(group)
+        for lid in removed:
+            self.layer_group[lid] = None
+            self.layer_row[lid] = -1
+            self.checked[lid] = False
+            self.selected[lid] = False
+            self.visible[lid] = False
+
+        for lid in changed:
+            index = self.layer_index(lid)
+            self.dataChanged.emit(index, index)
+
+        added_by_color = {}
+        for lid in added:
+            added_by_color.setdefault(self.errors.color_of(lid), []).append(lid)
+        for color, lids in added_by_color.items():
+            group = self.group_by_color.get(color)
+            if group is None:
+                row = bisect.bisect(self.groups, color, key=lambda g: g.color)
+                group = ColorGroup(color, [])
+                self.beginInsertRows(QModelIndex(), row, row)
+                self.groups.insert(row, group)
+                self.group_by_color[color] = group
+                self._renumber(row)
+                self.endInsertRows()
+            first = len(group.lids)
+            self.beginInsertRows(self.group_index(group), first, first + len(lids) - 1)
+            group.lids.extend(lids)
+            group.changed()
+            self.layer_row[lids] = np.arange(first, first + len(lids))
+            self.visible[lids] = group.selected
+            for lid in lids:
+                self.layer_group[lid] = group
+            self.endInsertRows()
+            touched.add(group)
+
+        for group in touched:
+            if group.lids:
+                index = self.group_index(group)
+                self.dataChanged.emit(index, index)
+            elif self.group_by_color.get(group.color) is group:
+                self.beginRemoveRows(QModelIndex(), group.row, group.row)
+                del self.groups[group.row]
+                del self.group_by_color[group.color]
+                self._renumber(group.row)
+                self.endRemoveRows()
+        return {group for group in touched if self.group_by_color.get(group.color) is group}
+
+    def update_selection(self, selection, state):
+        # Mirrors a selection model delta into the arrays. Returns the ids of the layers whose
+        # selected or visible state may have changed, and the groups of newly selected layers
+        # whose own row is not selected yet.
+        lids, parents = [], []
+        for selection_range in selection:
+            parent = selection_range.parent()
+            rows = slice(selection_range.top(), selection_range.bottom() + 1)
+            if not parent.isValid():
+                for group in self.groups[rows]:
+                    group.selected = state
+                    group_lids = group.lid_array()
+                    self.visible[group_lids] = self.checked[group_lids] | state
+                    lids.append(group_lids)
+            else:
+                group = self.groups[parent.row()]
+                group_lids = group.lid_array()[rows]
+                self.selected[group_lids] = state
+                lids.append(group_lids)
+                if state and not group.selected:
+                    parents.append(group)
+        return np.concatenate([np.asarray(ids, dtype=np.intp) for ids in lids] or [np.zeros(0, dtype=np.intp)]), parents
+
+    def set_all_checked(self, checked):
+        self.checked[:] = False
+        self.visible[:] = False
+        for group in self.groups:
+            if group.lids:
+                self.checked[group.lids] = checked
+                self.visible[group.lids] = checked or group.selected
+                parent = self.group_index(group)
+                self.dataChanged.emit(self.index(0, 0, parent), self.index(len(group.lids) - 1, 0, parent),
+                                      [Qt.ItemDataRole.CheckStateRole])
+        self.checkStateChanged.emit(np.arange(len(self.checked)))
 
 class OutlineCheckApp(QMainWindow):
+    analysisRequested = pyqtSignal(int, object, int)
+    framesRequested = pyqtSignal(int, object, int)
+    fixAllRequested = pyqtSignal(int, object, object, object, int)
+
     def __init__(self):
         super().__init__()
         self.current_lang = "EN"
@@ -213,18 +740,65 @@ class OutlineCheckApp(QMainWindow):
         self.setWindowIcon(QIcon("OutlineCheck.ico"))
         self.resize(1400, 950)
         
-        self.history = []
-        self.history_index = -1
-        self.current_img = None
-        self.layers = []
-        self.pixel_to_layers = {}
+        self.history = PixelHistory()
+        # The document is one contiguous (h, w, 4) uint8 RGBA buffer per frame, edited in place
+        # and shown by the left canvas through a QImage view; PIL is only used to load and save.
+        # Full-image copies: brush dabs, selection changes, committed strokes, fixes and
+        # undo/redo make none (update_edit_views patches the preview in place). There is one
+        # per update_canvas_views() (fill colour change, new analysis, frame switch) into
+        # preview_pixels, one per analyze_image() (the worker's snapshot), and for fix-all
+        # the analysis copy handed to the worker, plus its own "before" snapshot there.
+        self.pixels = None
+        self.preview_pixels = None
+        # What preview_pixels was built from, so selection changes can patch it in place:
+        # the document buffer, the error table, the fill colour and the filled layers.
+        self.preview_source = None
+        self.preview_errors = None
+        self.preview_fill = None
+        self.preview_selected = np.zeros(0, dtype=bool)
+        # Outline colours the tree filter was last applied with.
+        self.filtered_outline_colors = set()
+        self.analysis = OutlineAnalysis()
+        self.frames = []
+        self.frame_index = 0
+        self.analysis_frame = None
         self.replacement_color = None 
-        self.outline_colors = set()
         self.show_only_outlines = True
+        self.analysis_generation = 0
+        self.analysis_pending = False
+        self.analysis_in_sync = False
+        # Generation of the last fix-all request; it is running while analysis_generation matches.
+        self.fix_all_generation = None
+        self.stroke_edits = {}
+        self.pending_edits = []
+        self.edit_timer = QTimer(self)
+        self.edit_timer.setSingleShot(True)
+        self.edit_timer.setInterval(50)
+        self.edit_timer.timeout.connect(self.flush_edits)
         self.init_ui()
         self.setup_shortcuts()
+        self.setup_analysis_worker()
         self.setFocusPolicy(Qt.FocusPolicy.StrongFocus)
 
+    def setup_analysis_worker(self):
+        self.analysis_thread = QThread(self)
+        self.analysis_worker = AnalysisWorker()
+        self.analysis_worker.moveToThread(self.analysis_thread)
+        self.analysisRequested.connect(self.analysis_worker.run)
+        self.framesRequested.connect(self.analysis_worker.run_frames)
+        self.fixAllRequested.connect(self.analysis_worker.run_fix_all)
+        self.analysis_worker.progress.connect(self.on_analysis_progress)
+        self.analysis_worker.finished.connect(self.on_analysis_finished)
+        self.analysis_worker.framesFinished.connect(self.on_frames_finished)
+        self.analysis_worker.fixAllFinished.connect(self.on_fix_all_finished)
+        self.analysis_thread.start()
+
+    def closeEvent(self, event):
+        self.cancel_analysis()
+        self.analysis_thread.quit()
+        self.analysis_thread.wait()
+        super().closeEvent(event)
+
     def init_ui(self):
         central_widget = QWidget()
         central_widget.setObjectName("mainCanvas")
@@ -311,6 +885,51 @@ class OutlineCheckApp(QMainWindow):
         pipette_layout.addLayout(tool_row)
         sidebar_layout.addWidget(pipette_panel)
 
+        # Rubber-band and lasso selection, restricted to the checked categories and optionally
+        # to the colour under the start of the drag.
+        region_panel = QFrame()
+        region_panel.setObjectName("toolPanel")
+        region_layout = QVBoxLayout(region_panel)
+        region_layout.setContentsMargins(12, 12, 12, 12)
+        region_layout.setSpacing(10)
+        self.region_header = QLabel(LANGUAGES[self.current_lang]["region_header"])
+        self.region_header.setStyleSheet("color: #888; font-size: 10px; letter-spacing: 1px;")
+        region_layout.addWidget(self.region_header)
+        region_tool_row = QHBoxLayout()
+        region_tool_row.setSpacing(10)
+        self.select_mode_buttons = {}
+        for mode in ("rect", "lasso"):
+            button = QPushButton()
+            button.setFixedSize(48, 48)
+            button.setObjectName("toolBtn")
+            button.setIcon(self.create_icon_svg(mode))
+            button.setIconSize(QSize(28, 28))
+            button.clicked.connect(lambda checked, mode=mode: self.toggle_select_mode(mode))
+            self.select_mode_buttons[mode] = button
+            region_tool_row.addWidget(button)
+        region_tool_row.addStretch()
+        region_layout.addLayout(region_tool_row)
+        region_filter_row = QHBoxLayout()
+        self.region_category_buttons = {}
+        for key in CATEGORY_KEYS:
+            button = QPushButton(key)
+            button.setObjectName("miniBtn")
+            button.setCheckable(True)
+            button.setChecked(True)
+            button.setFixedSize(36, 20)
+            button.setToolTip(CATEGORY_NAMES[key])
+            self.region_category_buttons[key] = button
+            region_filter_row.addWidget(button)
+        self.btn_region_color = QPushButton(LANGUAGES[self.current_lang]["same_color"])
+        self.btn_region_color.setObjectName("miniBtn")
+        self.btn_region_color.setCheckable(True)
+        self.btn_region_color.setFixedSize(50, 20)
+        self.btn_region_color.setToolTip(LANGUAGES[self.current_lang]["same_color_tip"])
+        region_filter_row.addWidget(self.btn_region_color)
+        region_filter_row.addStretch()
+        region_layout.addLayout(region_filter_row)
+        sidebar_layout.addWidget(region_panel)
+
         group_header_layout = QHBoxLayout()
         self.groups_label = QLabel(LANGUAGES[self.current_lang]["groups_header"])
         group_header_layout.addWidget(self.groups_label)
@@ -324,14 +943,58 @@ class OutlineCheckApp(QMainWindow):
         self.update_toggle_text()
         sidebar_layout.addWidget(self.btn_toggle_outline)
 
-
-        self.layer_tree = QTreeWidget()
+        cell_row = QHBoxLayout()
+        self.cell_label = QLabel(LANGUAGES[self.current_lang]["cell_size"])
+        cell_row.addWidget(self.cell_label)
+        cell_row.addStretch()
+        # Sprite-sheet mode: cells are analyzed and cached independently, 0 analyzes the image as a whole.
+        self.spin_cell_size = QSpinBox()
+        self.spin_cell_size.setObjectName("cellSpin")
+        self.spin_cell_size.setRange(0, 1024)
+        self.spin_cell_size.setSingleStep(8)
+        self.spin_cell_size.setSuffix(" px")
+        self.spin_cell_size.setSpecialValueText(LANGUAGES[self.current_lang]["cell_off"])
+        self.spin_cell_size.setFixedWidth(90)
+        self.spin_cell_size.valueChanged.connect(lambda value: self.analyze_image())
+        cell_row.addWidget(self.spin_cell_size)
+        sidebar_layout.addLayout(cell_row)
+
+
+        self.layer_model = ErrorTreeModel(self)
+        self.layer_model.checkStateChanged.connect(self.update_selection_views)
+        self.layer_tree = QTreeView()
         self.layer_tree.setHeaderHidden(True)
+        self.layer_tree.setUniformRowHeights(True)
         self.layer_tree.setSelectionMode(QAbstractItemView.SelectionMode.ExtendedSelection)
-        self.layer_tree.itemSelectionChanged.connect(self.on_selection_changed)
-        self.layer_tree.itemChanged.connect(self.on_item_visibility_changed)
+        self.layer_tree.setModel(self.layer_model)
+        self.layer_tree.selectionModel().selectionChanged.connect(self.on_selection_changed)
         sidebar_layout.addWidget(self.layer_tree)
 
+        self.btn_fix_all_frames = QPushButton(LANGUAGES[self.current_lang]["fix_all_frames"])
+        self.btn_fix_all_frames.setObjectName("fixButton")
+        self.btn_fix_all_frames.clicked.connect(self.fix_selection_in_all_frames)
+        self.btn_fix_all_frames.hide()
+        sidebar_layout.addWidget(self.btn_fix_all_frames)
+
+        # Auto-fix: every error of the checked categories, repeated until none is left.
+        fix_all_row = QHBoxLayout()
+        self.fix_category_buttons = {}
+        for key in CATEGORY_KEYS:
+            button = QPushButton(key)
+            button.setObjectName("miniBtn")
+            button.setCheckable(True)
+            button.setChecked(True)
+            button.setFixedSize(40, 20)
+            button.setToolTip(CATEGORY_NAMES[key])
+            self.fix_category_buttons[key] = button
+            fix_all_row.addWidget(button)
+        fix_all_row.addStretch()
+        sidebar_layout.addLayout(fix_all_row)
+        self.btn_fix_all = QPushButton(LANGUAGES[self.current_lang]["fix_all"])
+        self.btn_fix_all.setObjectName("fixButton")
+        self.btn_fix_all.clicked.connect(self.fix_all_errors)
+        sidebar_layout.addWidget(self.btn_fix_all)
+
         # self.btn_fix = QPushButton(LANGUAGES[self.current_lang]["fix_btn"])
         # self.btn_fix.setObjectName("fixButton")
         # self.btn_fix.clicked.connect(self.fix_selected_layers)
@@ -341,9 +1004,42 @@ class OutlineCheckApp(QMainWindow):
         self.info_label.setStyleSheet("color: #666; font-size: 11px;")
         sidebar_layout.addWidget(self.info_label)
 
+        self.analysis_progress = QProgressBar()
+        self.analysis_progress.setFixedWidth(160)
+        self.analysis_progress.setRange(0, 100)
+        self.analysis_progress.hide()
+        self.btn_cancel_analysis = QPushButton(LANGUAGES[self.current_lang]["cancel"])
+        self.btn_cancel_analysis.setObjectName("miniBtn")
+        self.btn_cancel_analysis.setFixedSize(70, 20)
+        self.btn_cancel_analysis.clicked.connect(self.cancel_analysis)
+        self.btn_cancel_analysis.hide()
+        self.statusBar().addPermanentWidget(self.analysis_progress)
+        self.statusBar().addPermanentWidget(self.btn_cancel_analysis)
+        # Profiling overlay (F12): last duration of each phase, full statistics in the tooltip.
+        self.profile_label = QLabel()
+        self.profile_label.setVisible(PROFILER.enabled)
+        self.statusBar().addPermanentWidget(self.profile_label)
+        self.profile_timer = QTimer(self)
+        self.profile_timer.setInterval(500)
+        self.profile_timer.timeout.connect(self.update_profile_overlay)
+        if PROFILER.enabled:
+            self.profile_timer.start()
+
         work_area = QFrame()
         work_area.setObjectName("workArea")
         work_layout = QVBoxLayout(work_area)
+
+        self.frame_strip = QListWidget()
+        self.frame_strip.setObjectName("frameStrip")
+        self.frame_strip.setFlow(QListWidget.Flow.LeftToRight)
+        self.frame_strip.setViewMode(QListWidget.ViewMode.IconMode)
+        self.frame_strip.setMovement(QListWidget.Movement.Static)
+        self.frame_strip.setWrapping(False)
+        self.frame_strip.setIconSize(QSize(48, 48))
+        self.frame_strip.setFixedHeight(96)
+        self.frame_strip.currentRowChanged.connect(self.select_frame)
+        self.frame_strip.hide()
+        work_layout.addWidget(self.frame_strip)
         
         self.splitter = QSplitter(Qt.Orientation.Horizontal)
         
@@ -355,6 +1051,8 @@ class OutlineCheckApp(QMainWindow):
         self.canvas_left.pixelSelected.connect(self.select_layer_by_id)
         self.canvas_left.colorPicked.connect(self.set_active_color)
         self.canvas_left.brushPainted.connect(self.paint_pixel)
+        self.canvas_left.strokeFinished.connect(self.commit_stroke)
+        self.canvas_left.regionSelected.connect(self.on_region_selected)
         layout_left.addWidget(self.canvas_left, 1)
         
         container_right = QFrame()
@@ -387,6 +1085,10 @@ class OutlineCheckApp(QMainWindow):
                 background-color: #21252b; color: #00c3ff; border: 1px solid #282c34;
                 border-radius: 6px; padding: 4px 8px; font-weight: bold; font-size: 11px;
             }
+            QSpinBox#cellSpin {
+                background-color: #21252b; color: #00c3ff; border: 1px solid #282c34;
+                border-radius: 6px; padding: 4px 8px; font-weight: bold; font-size: 11px;
+            }
             QComboBox#langCombo QAbstractItemView { background-color: #21252b; selection-background-color: #25252f; color: #00c3ff; border: 1px solid #282c34; }
 
             #colorPreviewBtn { border-radius: 10px; border: 2px solid #333; padding: 0px; }
@@ -398,6 +1100,7 @@ class OutlineCheckApp(QMainWindow):
                 background-color: #21252b; border-color: #282c34; border-radius: 4px;
             }
             #miniBtn:hover { background-color: #2d2d33; color: #00c3ff; }
+            #miniBtn:checked { color: #00c3ff; border-color: #00c3ff; }
             
             #fixButton { 
                 background-color: #0062ff; color: white; border: none; text-align: center;
@@ -405,13 +1108,19 @@ class OutlineCheckApp(QMainWindow):
             }
             #fixButton:hover { background-color: #0052db; }
             
-            QTreeWidget { 
+            QListWidget#frameStrip {
+                background: #21252b; border: 1px solid #282c34; border-radius: 8px; color: #a0a0a5; font-size: 10px;
+            }
+            QListWidget#frameStrip::item:selected { background-color: #25252f; color: #00c3ff; }
+
+            QTreeView { 
                 background: #21252b; border: 1px solid #282c34; border-radius: 8px; 
                 outline: none; color: #d0d0d5;
             }
-            QTreeWidget::item { padding: 6px; border-bottom: 1px solid #212126; }
-            QTreeWidget::item:selected { background-color: #25252f; color: #00c3ff; }
+            QTreeView::item { padding: 6px; border-bottom: 1px solid #212126; }
+            QTreeView::item:selected { background-color: #25252f; color: #00c3ff; }
             QScrollArea { border: 1px solid #282c34; border-radius: 12px; background: #404040; }
+            QStatusBar { background-color: #2C2D32; color: #666; font-size: 11px; }
         """)
 
     def change_language(self, lang_code):
@@ -422,12 +1131,21 @@ class OutlineCheckApp(QMainWindow):
         self.btn_save.setText(t["save"])
         self.pipette_header.setText(t["replacement_header"])
         self.groups_label.setText(t["groups_header"])
-        self.btn_fix.setText(t["fix_btn"])
         self.info_label.setText(t["info"])
         self.detect_label.setText(t["detect_title"])
         self.preview_label.setText(t["preview_title"])
+        self.btn_cancel_analysis.setText(t["cancel"])
+        self.btn_fix_all_frames.setText(t["fix_all_frames"])
+        self.btn_fix_all.setText(t["fix_all"])
+        self.region_header.setText(t["region_header"])
+        self.btn_region_color.setText(t["same_color"])
+        self.btn_region_color.setToolTip(t["same_color_tip"])
+        for index in range(len(self.frames)):
+            self.update_frame_item(index)
+        self.cell_label.setText(t["cell_size"])
+        self.spin_cell_size.setSpecialValueText(t["cell_off"])
         self.update_toggle_text()
-        if self.current_img:
+        if self.pixels is not None:
             self.analyze_image()
 
     def create_icon_svg(self, name):
@@ -473,6 +1191,14 @@ class OutlineCheckApp(QMainWindow):
             ]:
                 painter.setBrush(color); painter.setPen(QPen(color, 2))
                 painter.drawPolygon(pts)
+        elif name == "rect":
+            painter.setPen(QPen(Qt.GlobalColor.white, 4, Qt.PenStyle.DashLine))
+            painter.drawRect(12, 16, 40, 32)
+        elif name == "lasso":
+            painter.setPen(QPen(Qt.GlobalColor.white, 4, Qt.PenStyle.DashLine))
+            painter.drawEllipse(10, 12, 44, 28)
+            painter.setPen(QPen(Qt.GlobalColor.white, 4))
+            painter.drawLine(22, 38, 18, 54)
         painter.end()
         return QIcon(pix)
 
@@ -501,15 +1227,7 @@ class OutlineCheckApp(QMainWindow):
         self.btn_color_preview.setIconSize(QSize(size, size))
 
     def batch_check(self, state):
-        self.layer_tree.blockSignals(True)
-        root = self.layer_tree.invisibleRootItem()
-        for i in range(root.childCount()):
-            item = root.child(i)
-            item.setCheckState(0, state)
-            for j in range(item.childCount()):
-                item.child(j).setCheckState(0, state)
-        self.layer_tree.blockSignals(False)
-        self.update_canvas_views()
+        self.layer_model.set_all_checked(state == Qt.CheckState.Checked)
 
     def open_color_dialog(self):
         initial = self.replacement_color if self.replacement_color else Qt.GlobalColor.white
@@ -520,6 +1238,7 @@ class OutlineCheckApp(QMainWindow):
     def toggle_picker_mode(self):
         self.canvas_left.brush_mode = False
         self.btn_brush.setStyleSheet("")
+        self.set_select_mode(None)
         self.canvas_left.picker_mode = not self.canvas_left.picker_mode
         if self.canvas_left.picker_mode:
             self.setCursor(Qt.CursorShape.CrossCursor)
@@ -531,6 +1250,7 @@ class OutlineCheckApp(QMainWindow):
     def toggle_brush_mode(self):
         self.canvas_left.picker_mode = False
         self.btn_eye_dropper.setStyleSheet("")
+        self.set_select_mode(None)
         
         self.canvas_left.brush_mode = not self.canvas_left.brush_mode
         
@@ -541,10 +1261,25 @@ class OutlineCheckApp(QMainWindow):
             self.setCursor(Qt.CursorShape.ArrowCursor)
             self.btn_brush.setStyleSheet("")
 
+    def toggle_select_mode(self, mode):
+        self.canvas_left.picker_mode = False
+        self.canvas_left.brush_mode = False
+        self.btn_eye_dropper.setStyleSheet("")
+        self.btn_brush.setStyleSheet("")
+        self.set_select_mode(None if self.canvas_left.select_mode == mode else mode)
+        self.setCursor(Qt.CursorShape.CrossCursor if self.canvas_left.select_mode else Qt.CursorShape.ArrowCursor)
+
+    def set_select_mode(self, mode):
+        self.canvas_left.select_mode = mode
+        self.canvas_left.band = []
+        for key, button in self.select_mode_buttons.items():
+            button.setStyleSheet("background-color: #00c3ff; border: 1px solid white;" if key == mode else "")
+
     def set_active_color(self, qcolor):
         self.replacement_color = qcolor
         self.canvas_left.picker_mode = False
         self.canvas_left.brush_mode = False
+        self.set_select_mode(None)
 
         self.btn_eye_dropper.setStyleSheet("")
         self.btn_brush.setStyleSheet("")
@@ -583,294 +1318,255 @@ class OutlineCheckApp(QMainWindow):
 
         QShortcut(QKeySequence("O"), self).activated.connect(self.toggle_picker_mode)
         QShortcut(QKeySequence("P"), self).activated.connect(self.toggle_brush_mode)
+        QShortcut(QKeySequence("R"), self).activated.connect(lambda: self.toggle_select_mode("rect"))
+        QShortcut(QKeySequence("L"), self).activated.connect(lambda: self.toggle_select_mode("lasso"))
         QShortcut(QKeySequence("C"), self).activated.connect(self.open_color_dialog)
         QShortcut(QKeySequence("Ctrl+S"), self).activated.connect(self.save_image)
+        QShortcut(QKeySequence("Esc"), self).activated.connect(self.cancel_analysis)
+        QShortcut(QKeySequence("F12"), self).activated.connect(self.toggle_profiling)
+        QShortcut(QKeySequence("Shift+F12"), self).activated.connect(self.save_profile_trace)
 
     def open_image(self):
-        path, _ = QFileDialog.getOpenFileName(self, "Open Image", "", "Images (*.png *.bmp)")
-        if path:
-            img = Image.open(path).convert("RGBA")
-            self.history = []
-            self.history_index = -1
-            self.push_history(img)
+        # Several files open as a frame sequence, in name order; GIF/APNG files open all their frames.
+        paths, _ = QFileDialog.getOpenFileNames(self, "Open Image", "", "Images (*.png *.apng *.gif *.bmp)")
+        if paths:
+            self.load_document(sorted(paths))
+
+    def load_document(self, paths):
+        self.edit_timer.stop()
+        self.stroke_edits = {}
+        self.pending_edits = []
+        frames, durations = load_frames(paths)
+        self.frames = [AnimationFrame(frame, duration)
+                       for frame, duration in zip(frames, durations)]
+        self.load_frame(0)
+        self.update_history_status()
+        self.rebuild_layer_tree()
+        self.populate_frame_strip()
+        self.update_canvas_views()
+        if len(self.frames) > 1:
+            self.analyze_all_frames()
+        else:
             self.analyze_image()
 
     def save_image(self):
-        if not self.current_img: return
+        if self.pixels is None: return
+        if len(self.frames) > 1:
+            path, _ = QFileDialog.getSaveFileName(self, "Export", "pixel_fix.png", "APNG (*.png);;GIF (*.gif)")
+            if path:
+                images = [Image.fromarray(f.pixels) for f in self.frames]
+                images[0].save(path, save_all=True, append_images=images[1:],
+                               duration=[f.duration for f in self.frames], loop=0)
+            return
         path, _ = QFileDialog.getSaveFileName(self, "Export", "pixel_fix.png", "PNG (*.png)")
         if path:
-            self.current_img.save(path)
-
-    def push_history(self, img):
-        self.history = self.history[:self.history_index + 1]
-        self.history.append(img.copy())
-        self.history_index += 1
-        self.current_img = img
-
-    def _save_tree_state(self):
-        color_states, expansion_states, parent_states = {}, {}, {}
-        root = self.layer_tree.invisibleRootItem()
-        for i in range(root.childCount()):
-            parent = root.child(i)
-            color_hex = parent.text(0)
-            expansion_states[color_hex] = parent.isExpanded()
-            parent_states[color_hex] = parent.checkState(0)
-            color_states[color_hex] = {}
-            for j in range(parent.childCount()):
-                child = parent.child(j)
-                lid = child.data(0, Qt.ItemDataRole.UserRole)
-                color_states[color_hex][lid] = child.checkState(0)
-        return color_states, expansion_states, parent_states
-    
-    def _restore_tree_state(self, color_states, expansion_states, parent_states):
-        root = self.layer_tree.invisibleRootItem()
-        for i in range(root.childCount()):
-            parent = root.child(i)
-            color_hex = parent.text(0)
-            if color_hex in expansion_states:
-                parent.setExpanded(expansion_states[color_hex])
-            if color_hex in color_states:
-                for j in range(parent.childCount()):
-                    child = parent.child(j)
-                    lid = child.data(0, Qt.ItemDataRole.UserRole)
-                    if lid in color_states[color_hex]:
-                        child.setCheckState(0, color_states[color_hex][lid])
-            if color_hex in parent_states:
-                parent.setCheckState(0, parent_states[color_hex])
-            if color_hex in color_states:
-                parent_state = parent_states.get(color_hex, Qt.CheckState.Checked)
-                for j in range(parent.childCount()):
-                    child = parent.child(j)
-                    lid = child.data(0, Qt.ItemDataRole.UserRole)
-                    if lid not in color_states[color_hex]:
-                        child.setCheckState(0, parent_state)
-    
-    def _history_move(self, direction):
-        new_index = self.history_index + direction
-        if not (0 <= new_index < len(self.history)):
+            Image.fromarray(self.pixels).save(path)
+
+    def store_frame(self):
+        frame = self.frames[self.frame_index]
+        frame.analysis, frame.analysis_in_sync = self.analysis, self.analysis_in_sync
+
+    def load_frame(self, index):
+        frame = self.frames[index]
+        self.frame_index = index
+        self.pixels, self.history = frame.pixels, frame.history
+        self.analysis, self.analysis_in_sync = frame.analysis, frame.analysis_in_sync
+
+    def populate_frame_strip(self):
+        self.frame_strip.blockSignals(True)
+        self.frame_strip.clear()
+        for index, frame in enumerate(self.frames):
+            self.frame_strip.addItem(QListWidgetItem(""))
+            self.update_frame_item(index)
+        self.frame_strip.setCurrentRow(self.frame_index)
+        self.frame_strip.blockSignals(False)
+        animated = len(self.frames) > 1
+        self.frame_strip.setVisible(animated)
+        self.btn_fix_all_frames.setVisible(animated)
+
+    def update_frame_item(self, index):
+        item = self.frame_strip.item(index)
+        if item is None:
             return
-        color_states, expansion_states, parent_states = self._save_tree_state()
-        self.history_index = new_index
-        self.current_img = self.history[self.history_index]
-        self.layer_tree.blockSignals(True)
-        self.analyze_image()
-        self._restore_tree_state(color_states, expansion_states, parent_states)
-        self.layer_tree.blockSignals(False)
+        frame = self.frames[index]
+        errors = sum(frame.analysis.category_counts().values()) if frame.analysis_in_sync else "…"
+        item.setText(LANGUAGES[self.current_lang]["frame_label"].format(index=index + 1, errors=errors))
+        item.setIcon(QIcon(QPixmap.fromImage(rgba_view(frame.pixels).scaled(
+            48, 48, Qt.AspectRatioMode.KeepAspectRatio))))
+
+    def select_frame(self, index):
+        if not (0 <= index < len(self.frames)) or index == self.frame_index:
+            return
+        self.flush_edits()
+        self.store_frame()
+        self.update_frame_item(self.frame_index)
+        self.load_frame(index)
+        self.update_history_status()
+        self.rebuild_layer_tree()
         self.update_canvas_views()
+        if not self.analysis_in_sync and not self.analysis_pending:
+            self.analyze_image()
 
-    def check_pattern_match(self, pattern, color_mask, bad_pixel_mask):
-        for r in range(3):
-            for c in range(3):
-                p_val = pattern[r, c]
-                if p_val == 2 or p_val == 3:
-                    continue
-                color_val = color_mask[r, c]
-                if p_val == 1 and not color_val:
-                    return False
-                if p_val == 0 and color_val:
-                    return False
-                if p_val == 4 and (not color_val or not bad_pixel_mask[r, c]):
-                    return False
-        return True
-    def apply_pattern(self,layer, pattern_type):
-        if pattern_type == "CL":
-            layer.category = "CL"
-            layer.category_color = QColor(115, 0, 115)
-        elif pattern_type == "SC":
-            layer.category = "SC"
-            layer.category_color = QColor(255, 0, 0)
-        elif pattern_type == "OSC":
-            layer.category = "OSC"
-            layer.category_color = QColor(255, 155, 0)
-        elif pattern_type == "OT":
-            layer.category = "OT"
-            layer.category_color = QColor(255, 0, 200)
-        else:
-            layer.category = "CR"
-            layer.category_color = QColor(255, 255, 0)
-    def categorize_errors(self, img_np, bad_pixel_mask):
-            h, w, _ = img_np.shape
-            category_priority = {"CL": 4, "SC": 3, "OSC": 2, "CR": 1, "OT": 0}
+    def push_history(self, edits):
+        # edits: [(x, y, old_rgba, new_rgba)], already applied to pixels and img_np.
+        xs, ys, old, new = zip(*edits)
+        self.history.record(xs, ys, old, new)
+        self.update_history_status()
 
-            other_layers = [l for l in self.layers if l.category != "CL"]
-            
-            ot_pattern_1 = np.array([[2, 1, 0], [2, 3, 1], [0, 1, 2]])
-            ot_pattern_2 = np.array([[2, 1, 0], [1, 3, 1], [0, 2, 2]])
-            ot_patterns = [np.rot90(ot_pattern_1, k) for k in range(4)] + [np.rot90(ot_pattern_2, k) for k in range(4)]
-            osc_pattern_1 = np.array([[2, 4, 0], [2, 3, 2], [0, 2, 2]])
-            osc_pattern_2 = np.array([[2, 2, 0], [2, 3, 4], [0, 2, 2]])
-            osc_rotations = [np.rot90(osc_pattern_1, k) for k in range(4)] + [np.rot90(osc_pattern_2, k) for k in range(4)]
-            sc_pattern = np.array([[2, 4, 0], [2, 3, 4], [0, 2, 2]])
-            sc_rotations = [np.rot90(sc_pattern, k) for k in range(4)]
-            for layer in other_layers:
-                x, y = layer.x, layer.y
-                if y < 1 or y >= h - 1 or x < 1 or x >= w - 1:
-                    self.apply_pattern(layer, "CR")
-                    continue
-                
-                layer_color = layer.color_key
-                color_mask = np.all(img_np[y-1:y+2, x-1:x+2] == layer_color, axis=-1)
-                bad_mask = color_mask & bad_pixel_mask[y-1:y+2, x-1:x+2]
-                
-                if any(self.check_pattern_match(osc_rot, color_mask, bad_mask) for osc_rot in osc_rotations):
-                    self.apply_pattern(layer, "OSC")
-                    if any(self.check_pattern_match(sc_rot, color_mask, bad_mask) for sc_rot in sc_rotations):
-                        self.apply_pattern(layer, "SC")
-                elif any(self.check_pattern_match(ot_pat, color_mask, bad_mask) for ot_pat in ot_patterns):
-                    self.apply_pattern(layer, "OT")
-                else:
-                    self.apply_pattern(layer, "CR")
-
-            pos_to_layer = {(l.x, l.y): l for l in self.layers}
-            
-            staircase_layers = [l for l in self.layers if l.category == "SC"]
-            
-            queue = list(staircase_layers)
-            while queue:
-                current = queue.pop(0)
-                for dy in [-1, 0, 1]:
-                    for dx in [-1, 0, 1]:
-                        if dx == 0 and dy == 0: continue
-                        neighbor_pos = (current.x + dx, current.y + dy)
-                        
-                        if neighbor_pos in pos_to_layer:
-                            neighbor = pos_to_layer[neighbor_pos]
-                            if neighbor.category in ["OSC", "OT", "CR"]:
-                                self.apply_pattern(neighbor, "SC")
-                                queue.append(neighbor)
+    def update_history_status(self):
+        self.statusBar().showMessage(LANGUAGES[self.current_lang]["history_status"].format(
+            steps=len(self.history), size=self.history.nbytes / (1024 * 1024)))
+
+    def _history_move(self, direction):
+        self.flush_edits()
+        step = self.history.undo() if direction < 0 else self.history.redo()
+        if step is None:
+            return
+        xs, ys, colors = step
+        self.pixels[ys, xs] = colors
+        diff = self.update_analysis(list(zip(xs.tolist(), ys.tolist(), colors.tolist())))
+        self.update_history_status()
+        self.update_edit_views(xs, ys, *diff)
 
     def analyze_image(self):
-            if not self.current_img: return
-            img_np = np.array(self.current_img)
-            h, w, _ = img_np.shape
-            unique_colors = np.unique(img_np.reshape(-1, 4), axis=0)
-            
-            self.layers = []
-            self.pixel_to_layers = {}
-            self.outline_colors = set()
-
-            self.layer_tree.blockSignals(True)
-            self.layer_tree.clear()
-
-            alpha = img_np[:, :, 3]
-            is_opaque = alpha > 0
-            is_trans = alpha == 0
-            trans_padded = np.pad(is_trans, 1, constant_values=True)
-            t_up    = trans_padded[:-2, 1:-1]
-            t_down  = trans_padded[2:, 1:-1]
-            t_left  = trans_padded[1:-1, :-2]
-            t_right = trans_padded[1:-1, 2:]
-            has_trans_neighbor = t_up | t_down | t_left | t_right
-            is_outline = is_opaque & has_trans_neighbor
-            outline_pixels = img_np[is_outline]
-            if outline_pixels.size > 0:
-                u_out_colors = np.unique(outline_pixels.reshape(-1, 4), axis=0)
-                self.outline_colors = set(tuple(c) for c in u_out_colors)
-            self.layer_tree.blockSignals(True)
-            self.layer_tree.clear()
-            cl_pat1 = np.array([[2, 1, 1], [2, 3, 1], [2, 2, 2]])
-            cl_pat2 = np.array([[1, 1, 2], [1, 3, 2], [2, 2, 2]])
-            cl_rotations = [np.rot90(cl_pat1, k) for k in range(4)] + [np.rot90(cl_pat2, k) for k in range(4)]
-            
-            base_pattern = np.array([[2, 1, 0], [2, 3, 1], [0, 2, 2]])
-            rotations = [np.rot90(base_pattern, k) for k in range(4)]
-
-            color_count = {}
-            for y in range(1, h - 1):
-                for x in range(1, w - 1):
-                    color = tuple(img_np[y, x])
-                    if color[3] < 10: continue
-                    sub_mask = np.all(img_np[y-1:y+2, x-1:x+2] == color, axis=-1)
-                    
-                    is_cl = any(self._check_pattern_match_optimized(rot, sub_mask) for rot in cl_rotations)
-                    
-                    if is_cl:
-                        if color not in color_count: color_count[color] = []
-                        color_count[color].append((x, y, "CL"))
-                    else:
-                        is_pattern = any(self._check_pattern_match_optimized(rot, sub_mask) for rot in rotations)
-                        if is_pattern:
-                            if color not in color_count: color_count[color] = []
-                            color_count[color].append((x, y, "BAD"))
-
-            for color_tuple, pixels in color_count.items():
-                color_hex = '#%02x%02x%02x' % (color_tuple[0], color_tuple[1], color_tuple[2])
-                for x, y, p_type in pixels:
-                    lid = len(self.layers)
-                    new_layer = ErrorLayer(lid, x, y, color_tuple)
-                    if p_type == "CL":
-                        self.apply_pattern(new_layer, "CL")
-                    self.layers.append(new_layer)
-                    if (x, y) not in self.pixel_to_layers:
-                        self.pixel_to_layers[(x, y)] = []
-                    self.pixel_to_layers[(x, y)].append(lid)
-
-            bad_pixel_mask = np.zeros((h, w), dtype=bool)
-            for layer in self.layers:
-                bad_pixel_mask[layer.y, layer.x] = True
-            self.categorize_errors(img_np, bad_pixel_mask)
-
-            category_names = {"OT": "Outlines Touching", "SC": "Staircase", "OSC": "Optional Staircase", "CR": "Corner", "CL": "Cluster"}
-            for color in unique_colors:
-                if color[3] < 10: continue
-                color_tuple = tuple(color)
-                color_layers = [l for l in self.layers if l.color_key == color_tuple]
-                if not color_layers: continue
-                
-                color_hex = '#%02x%02x%02x' % (color[0], color[1], color[2])
-                parent_item = QTreeWidgetItem(self.layer_tree)
-                parent_item.setText(0, f"{color_hex} ({len(color_layers)})")
-                parent_item.setData(0, Qt.ItemDataRole.UserRole + 1, color_tuple)
-                
-                pix = QPixmap(16, 16)
-                pix.fill(QColor(color[0], color[1], color[2], color[3]))
-                parent_item.setIcon(0, QIcon(pix))
-                
-                for layer in color_layers:
-                    child_item = QTreeWidgetItem(parent_item)
-                    cat_name = category_names.get(layer.category, layer.category)
-                    child_item.setText(0, f"{cat_name} {layer.id} ({layer.x}, {layer.y})")
-                    child_item.setData(0, Qt.ItemDataRole.UserRole, layer.id)
-                    child_item.setFlags(child_item.flags() | Qt.ItemFlag.ItemIsUserCheckable)
-                    child_item.setCheckState(0, Qt.CheckState.Unchecked)
-                    cat_pix = QPixmap(12, 12)
-                    cat_pix.fill(layer.category_color)
-                    child_item.setIcon(0, QIcon(cat_pix))
+        # Starts a full analysis of pixels on the worker thread; any analysis still
+        # running for an older state is abandoned and its result dropped.
+        if self.pixels is None: return
+        self.analysis_generation += 1
+        self.analysis_worker.latest_generation = self.analysis_generation
+        self.analysis_pending = True
+        self.analysis_in_sync = False
+        self.analysis_progress.setValue(0)
+        self.analysis_progress.show()
+        self.btn_cancel_analysis.show()
+        self.analysis_frame = self.frame_index
+        self.analysisRequested.emit(self.analysis_generation, self.pixels.copy(), self.spin_cell_size.value())
+
+    def analyze_all_frames(self):
+        # Analyzes every frame on the worker thread, reusing each frame's analysis for the next.
+        self.store_frame()
+        self.analysis_generation += 1
+        self.analysis_worker.latest_generation = self.analysis_generation
+        self.analysis_pending = True
+        self.analysis_in_sync = False
+        for frame in self.frames:
+            frame.analysis_in_sync = False
+        self.analysis_progress.setValue(0)
+        self.analysis_progress.show()
+        self.btn_cancel_analysis.show()
+        self.analysis_frame = None
+        self.framesRequested.emit(self.analysis_generation, [f.pixels.copy() for f in self.frames],
+                                  self.spin_cell_size.value())
+
+    def cancel_analysis(self):
+        if not self.analysis_pending: return
+        if self.fix_all_generation == self.analysis_generation:
+            # The frame's analysis was left untouched by the fix, so it is still valid.
+            if self.analysis_frame == self.frame_index:
+                self.analysis_in_sync = True
+                self.store_frame()
+            else:
+                self.frames[self.analysis_frame].analysis_in_sync = True
+            self.update_frame_item(self.analysis_frame)
+        self.analysis_generation += 1
+        self.analysis_worker.latest_generation = self.analysis_generation
+        self.analysis_pending = False
+        self.analysis_frame = None
+        self.analysis_progress.hide()
+        self.btn_cancel_analysis.hide()
+
+    def on_analysis_progress(self, generation, percent):
+        if generation == self.analysis_generation:
+            self.analysis_progress.setValue(percent)
+
+    def on_analysis_finished(self, generation, analysis):
+        if generation != self.analysis_generation:
+            return
+        self.analysis_pending = False
+        self.analysis_progress.hide()
+        self.btn_cancel_analysis.hide()
+        self.update_cache_status()
+        # The analysed frame may no longer be the one on screen.
+        frame_index, self.analysis_frame = self.analysis_frame, None
+        if frame_index != self.frame_index:
+            frame = self.frames[frame_index]
+            frame.analysis, frame.analysis_in_sync = analysis, True
+            self.update_frame_item(frame_index)
+            if not self.analysis_in_sync:
+                self.analyze_image()
+            return
+        self.analysis = analysis
+        self.analysis_in_sync = True
+        self.store_frame()
+        self.update_frame_item(self.frame_index)
+        self.rebuild_layer_tree()
+        self.update_canvas_views()
 
-            self.apply_tree_filter()
-            self.layer_tree.blockSignals(False)
-            self.update_canvas_views()
+    def on_frames_finished(self, generation, analyses):
+        if generation != self.analysis_generation:
+            return
+        self.analysis_pending = False
+        self.analysis_progress.hide()
+        self.btn_cancel_analysis.hide()
+        self.update_cache_status()
+        for index, (frame, analysis) in enumerate(zip(self.frames, analyses)):
+            frame.analysis, frame.analysis_in_sync = analysis, True
+            self.update_frame_item(index)
+        self.load_frame(self.frame_index)
+        self.rebuild_layer_tree()
+        self.update_canvas_views()
 
-    def _check_pattern_match_optimized(self, pattern, sub_mask):
-        for r in range(3):
-            for c in range(3):
-                p_val = pattern[r, c]
-                m_val = sub_mask[r, c]
-                if (p_val == 3 or p_val == 1) and not m_val:
-                    return False
-                if p_val == 0 and m_val:
-                    return False
-        return True
+    def update_cache_status(self):
+        cache = self.analysis_worker.cache
+        self.statusBar().setToolTip(LANGUAGES[self.current_lang]["cache_status"].format(
+            hits=cache.hits + cache.disk_hits, misses=cache.misses))
 
-    def on_item_visibility_changed(self, item, column):
-        if item.parent() is not None:
-            self.update_canvas_views()
+    def rebuild_layer_tree(self):
+        with PROFILER.phase("tree_rebuild"):
+            self.layer_model.reset_layers(self.analysis.errors)
+            self.apply_tree_filter()
+
+    def update_analysis(self, edits):
+        # Re-evaluates only the neighbourhood of edits [(x, y, rgba)] that were just written to
+        # pixels and patches the tree. Returns the (added, removed, changed) layer ids.
+        h, w = self.pixels.shape[:2]
+        img_np = self.analysis.img_np
+        if (not self.analysis_in_sync or img_np is None or img_np.shape[:2] != (h, w) or not edits
+                or len(edits) > INCREMENTAL_EDIT_LIMIT):
+            self.analyze_image()
+            return [], [], []
+        added, removed, changed = self.analysis.update(edits)
+        self._patch_layer_tree(added, removed, changed)
+        self.store_frame()
+        self.update_frame_item(self.frame_index)
+        return added, removed, changed
+
+    def _patch_layer_tree(self, added, removed, changed):
+        # Check, selection and expansion states of untouched rows are kept by the model.
+        with PROFILER.phase("tree_patch"):
+            selection_model = self.layer_tree.selectionModel()
+            selection_model.blockSignals(True)
+            touched = self.layer_model.apply_diff(added, removed, changed)
+            selection_model.blockSignals(False)
+            # Only groups with new rows or whose colour joined or left the outlines can change.
+            for color in self.filtered_outline_colors ^ self.analysis.outline_colors:
+                group = self.layer_model.group_by_color.get(color)
+                if group is not None:
+                    touched.add(group)
+            self.apply_tree_filter(touched)
+
+    def on_selection_changed(self, selected, deselected):
+        lids_off, _ = self.layer_model.update_selection(deselected, False)
+        lids_on, parents = self.layer_model.update_selection(selected, True)
+        self.update_selection_views(np.concatenate([lids_off, lids_on]))
+        if parents:
+            # Selecting the groups re-enters this slot for the layers they show.
+            selection = QItemSelection()
+            for group in parents:
+                index = self.layer_model.group_index(group)
+                selection.select(index, index)
+            self.layer_tree.selectionModel().select(selection, QItemSelectionModel.SelectionFlag.Select)
 
-    def on_selection_changed(self):
-        root = self.layer_tree.invisibleRootItem()
-        for i in range(root.childCount()):
-            parent = root.child(i)
-            has_selected_child = False
-            for j in range(parent.childCount()):
-                child = parent.child(j)
-                if child.isSelected():
-                    has_selected_child = True
-                    break
-            
-            if has_selected_child:
-                parent.setSelected(True)
-        
-        self.update_canvas_views()
     def update_toggle_text(self):
         key = "toggle_outline_on" if self.show_only_outlines else "toggle_outline_off"
         self.btn_toggle_outline.setText(LANGUAGES[self.current_lang][key])
@@ -880,23 +1576,22 @@ class OutlineCheckApp(QMainWindow):
         self.update_toggle_text()
         self.apply_tree_filter()
 
-    def apply_tree_filter(self):
-        root = self.layer_tree.invisibleRootItem()
-        for i in range(root.childCount()):
-            item = root.child(i)
-            color_tuple = item.data(0, Qt.ItemDataRole.UserRole + 1)
-            
-            if self.show_only_outlines:
-                is_outline = color_tuple in self.outline_colors
-                item.setHidden(not is_outline)
-            else:
-                item.setHidden(False)
+    def apply_tree_filter(self, groups=None):
+        # Hides the groups of colours not found on an outline; groups limits the pass to the
+        # rows that may have changed since the last one.
+        root = QModelIndex()
+        outline_colors = self.analysis.outline_colors
+        for group in self.layer_model.groups if groups is None else groups:
+            hidden = self.show_only_outlines and group.color not in outline_colors
+            if self.layer_tree.isRowHidden(group.row, root) != hidden:
+                self.layer_tree.setRowHidden(group.row, root, hidden)
+        self.filtered_outline_colors = set(outline_colors)
 
     def paint_pixel(self, x, y):
-        if not self.current_img:
+        if self.pixels is None:
             return
             
-        w, h = self.current_img.size
+        h, w = self.pixels.shape[:2]
         if not (0 <= x < w and 0 <= y < h):
             return
 
@@ -910,157 +1605,332 @@ class OutlineCheckApp(QMainWindow):
         else:
             new_color = (0, 0, 0, 0)
 
-        current_pixel = self.current_img.getpixel((x, y))
+        current_pixel = tuple(self.pixels[y, x].tolist())
         if current_pixel == new_color:
             return
 
-        img_copy = self.current_img.copy()
-        img_copy.putpixel((x, y), new_color)
-
-        selected_parent_colors = set()
-        root = self.layer_tree.invisibleRootItem()
-        for i in range(root.childCount()):
-            parent = root.child(i)
-            if parent.isSelected():
-                color_hex = parent.text(0).split(' ')[0]
-                selected_parent_colors.add(color_hex)
-        
-        color_states, expansion_states, parent_states = self._save_tree_state()        
-        self.push_history(img_copy)
-        
-        self.layer_tree.blockSignals(True)
-        self.analyze_image()
-        self._restore_tree_state(color_states, expansion_states, parent_states)
-
-        root = self.layer_tree.invisibleRootItem()
-        for i in range(root.childCount()):
-            parent = root.child(i)
-            color_hex = parent.text(0).split(' ')[0]
-            if color_hex in selected_parent_colors:
-                parent.setSelected(True)
-
-        self.layer_tree.blockSignals(False)
-        self.update_canvas_views()
+        # Immediate feedback before the stroke is committed and re-analyzed: the left canvas
+        # shows self.pixels itself, the preview gets the same write.
+        self.pixels[y, x] = new_color
+        self.preview_pixels[y, x] = new_color
+        old_color = self.stroke_edits.get((x, y), (current_pixel, None))[0]
+        self.stroke_edits[(x, y)] = (old_color, new_color)
+        self.canvas_left.invalidate_pixels(x, y)
+        self.canvas_right.invalidate_pixels(x, y)
+
+    def commit_stroke(self):
+        # One history entry per stroke; the re-analysis is debounced so quick strokes share it.
+        edits = [(x, y, old, new) for (x, y), (old, new) in self.stroke_edits.items() if old != new]
+        self.stroke_edits = {}
+        if not edits:
+            return
+        self.push_history(edits)
+        self.pending_edits.extend((x, y, new) for x, y, _, new in edits)
+        self.edit_timer.start()
+
+    def flush_edits(self):
+        if self.stroke_edits:
+            self.commit_stroke()
+        self.edit_timer.stop()
+        if self.pending_edits:
+            edits, self.pending_edits = self.pending_edits, []
+            xs, ys, _ = zip(*edits)
+            self.update_edit_views(xs, ys, *self.update_analysis(edits))
 
     def update_canvas_views(self):
-        if not self.current_img: return
-        pix = QPixmap.fromImage(self.pil_to_qimage(self.current_img))
-        
-        visible, selected = set(), set()
-        root = self.layer_tree.invisibleRootItem()
-        
-        selected_folders = set()
-        forced_visible_layers = set()
-        
-        for i in range(root.childCount()):
-            parent = root.child(i)
-            is_parent_selected = parent.isSelected()
-            
-            if is_parent_selected:
-                selected_folders.add(i)
-            
-            for j in range(parent.childCount()):
-                child = parent.child(j)
-                lid = child.data(0, Qt.ItemDataRole.UserRole)
-                
-                is_forced_visible = child.checkState(0) == Qt.CheckState.Checked
-                is_parent_selected = parent.isSelected()
-                
-                if is_forced_visible:
-                    visible.add(lid)
-                    forced_visible_layers.add(lid)
-                elif is_parent_selected:
-                    visible.add(lid)
-                
-                if child.isSelected():
-                    selected.add(lid)
+        # Full refresh, after the pixels, the analysis or the fill colour changed.
+        if self.pixels is None: return
+        with PROFILER.phase("update_canvas_views"):
+            model = self.layer_model
+            self.canvas_left.set_image(self.pixels, self.analysis.errors, reset_view=False)
+            self.canvas_left.set_layer_states(model.visible, model.selected)
+
+            # The preview buffer is kept across updates so its QImage view stays valid.
+            if self.preview_pixels is None or self.preview_pixels.shape != self.pixels.shape:
+                self.preview_pixels = np.empty_like(self.pixels)
+            np.copyto(self.preview_pixels, self.pixels)
+            self.preview_source = self.pixels
+            self.preview_errors = self.analysis.errors
+            self.preview_fill = [0, 0, 0, 0] if self.replacement_color is None else [
+                self.replacement_color.red(), self.replacement_color.green(),
+                self.replacement_color.blue(), self.replacement_color.alpha()
+            ]
+            self.preview_selected = np.zeros(len(self.preview_errors), dtype=bool)
+            self.patch_preview(np.flatnonzero(model.selected[:len(self.preview_errors)]))
+            self.canvas_right.set_image(self.preview_pixels, None, reset_view=False)
+
+    def update_selection_views(self, lids):
+        # Selection and check changes of the layers lids: only their pixels are rewritten and
+        # only their bounding rectangle is repainted, whatever the number of errors.
+        if self.pixels is None: return
+        model = self.layer_model
+        errors = self.analysis.errors
+        if (self.preview_source is not self.pixels or self.preview_errors is not errors
+                or len(self.preview_selected) != len(errors) or len(model.selected) != len(errors)
+                or self.canvas_left.selected_layers is not model.selected
+                or self.canvas_left.visible_layers is not model.visible):
+            self.update_canvas_views()
+            return
+        with PROFILER.phase("update_selection_views"):
+            lids = np.asarray(lids, dtype=np.intp)
+            self.canvas_left.update_layers(lids)
+            xs, ys = self.patch_preview(lids)
+            if len(xs):
+                self.canvas_right.invalidate_pixels(xs.min(), ys.min(), xs.max() - xs.min() + 1,
+                                                    ys.max() - ys.min() + 1)
+
+    def update_edit_views(self, xs, ys, added, removed, changed):
+        # After the pixels (xs, ys) were written and re-analyzed by update_analysis(), which
+        # returned the layers added, removed and changed: both canvases are patched there
+        # only, so the cost follows the size of the edit rather than of the image.
+        if self.pixels is None: return
+        model = self.layer_model
+        errors = self.analysis.errors
+        if (not self.analysis_in_sync or self.preview_source is not self.pixels or self.preview_errors is not errors
+                or self.canvas_left.errors is not errors or len(model.selected) != len(errors)):
+            self.update_canvas_views()
+            return
+        with PROFILER.phase("update_edit_views"):
+            xs = np.asarray(xs, dtype=np.intp)
+            ys = np.asarray(ys, dtype=np.intp)
+            removed = np.asarray(removed, dtype=np.intp)
+            kept = np.asarray(list(added) + list(changed), dtype=np.intp)
+            # Removed layers first: an added one can take their pixel.
+            self.canvas_left.set_layer_states(model.visible, model.selected, removed)
+            self.canvas_left.update_layers(kept)
+            self.canvas_left.invalidate_pixels(xs.min(), ys.min(), xs.max() - xs.min() + 1, ys.max() - ys.min() + 1)
+
+            # The preview takes the new pixels, then every layer at them or in the diff is refilled.
+            grow = len(errors) - len(self.preview_selected)
+            if grow > 0:
+                self.preview_selected = np.concatenate([self.preview_selected, np.zeros(grow, dtype=bool)])
+            lids = np.concatenate([removed, kept, errors.ids_at(xs, ys)])
+            xs = np.concatenate([xs, errors.x[lids]])
+            ys = np.concatenate([ys, errors.y[lids]])
+            self.preview_pixels[ys, xs] = self.pixels[ys, xs]
+            self.preview_selected[lids] = False
+            self.patch_preview(lids)
+            self.canvas_right.invalidate_pixels(xs.min(), ys.min(), xs.max() - xs.min() + 1, ys.max() - ys.min() + 1)
+
+    def patch_preview(self, lids):
+        # Fills the pixels of the newly selected layers among lids and restores those of the
+        # deselected ones. Returns the xs, ys written.
+        errors = self.preview_errors
+        filled = self.layer_model.selected[lids]
+        changed = filled != self.preview_selected[lids]
+        lids, filled = lids[changed], filled[changed]
+        xs, ys = errors.x[lids], errors.y[lids]
+        self.preview_pixels[ys[filled], xs[filled]] = self.preview_fill
+        self.preview_pixels[ys[~filled], xs[~filled]] = self.pixels[ys[~filled], xs[~filled]]
+        self.preview_selected[lids] = filled
+        return xs, ys
 
-        self.canvas_left.visible_layers = visible
-        self.canvas_left.selected_layers = selected
-        self.canvas_left.set_layers(self.layers)
-        self.canvas_left.set_image(pix, self.pixel_to_layers, reset_view=False)
+    def select_layer_by_id(self, layer_id, add_to_selection=False):
+        index = self.layer_model.layer_index(layer_id)
+        if not index.isValid():
+            return
+        selection_model = self.layer_tree.selectionModel()
+        if not add_to_selection:
+            selection_model.clearSelection()
+        selection = QItemSelection(index.parent(), index.parent())
+        selection.select(index, index)
+        selection_model.select(selection, QItemSelectionModel.SelectionFlag.Select)
+        self.layer_tree.scrollTo(index)
+        if self.canvas_left.brush_mode:
+            self.fix_selected_layers()
+
+    def on_region_selected(self, kind, points, add_to_selection):
+        if self.pixels is None: return
+        start = time.perf_counter()
+        categories = [key for key, button in self.region_category_buttons.items() if button.isChecked()]
+        # Every pixel the bounding rectangle touches, at least the one clicked.
+        xs, ys = zip(*points)
+        x0, y0 = math.floor(min(xs)), math.floor(min(ys))
+        x1, y1 = max(math.ceil(max(xs)), x0 + 1), max(math.ceil(max(ys)), y0 + 1)
+        polygon = points if kind == "lasso" else None
+        colors = None
+        if self.btn_region_color.isChecked():
+            h, w = self.pixels.shape[:2]
+            x, y = math.floor(points[0][0]), math.floor(points[0][1])
+            if not (0 <= x < w and 0 <= y < h):
+                return
+            colors = [tuple(self.pixels[y, x].tolist())]
+        lids = self.analysis.errors.query(x0, y0, x1, y1, categories=categories, colors=colors, polygon=polygon)
+        count = self.select_layers(lids, add_to_selection)
+        self.statusBar().showMessage(LANGUAGES[self.current_lang]["region_status"].format(
+            count=count, ms=(time.perf_counter() - start) * 1000))
+
+    def select_layers(self, lids, add_to_selection=False):
+        # Selects any number of layers in one selection-model update: one range per run of
+        # consecutive rows of a group, plus the groups themselves as select_layer_by_id does.
+        # Returns the number of layers selected.
+        model = self.layer_model
+        lids = np.asarray(lids, dtype=np.intp)
+        groups = set()
+        if add_to_selection:
+            # The current selection is rebuilt with the new layers: Qt merges ranges added on
+            # top of a selection pairwise, in time quadratic in their number.
+            lids = np.union1d(np.flatnonzero(model.selected), lids)
+            groups = {group for group in model.groups if group.selected}
+        lids = lids[model.layer_row[lids] >= 0]
+        color_ids, inverse = np.unique(model.errors.color_index[lids], return_inverse=True)
+        lid_groups = [model.group_by_color[model.errors.colors[i]] for i in color_ids.tolist()]
+        # Groups come first so that on_selection_changed finds them selected with their layers.
+        selection = QItemSelection()
+        for group in groups.union(lid_groups):
+            index = model.group_index(group)
+            selection.select(index, index)
+        if len(lids):
+            group_rows = np.array([group.row for group in lid_groups])[inverse]
+            layer_rows = model.layer_row[lids]
+            order = np.lexsort((layer_rows, group_rows))
+            group_rows, layer_rows = group_rows[order], layer_rows[order]
+            starts = np.concatenate([[0], np.flatnonzero((np.diff(group_rows) != 0) | (np.diff(layer_rows) != 1)) + 1])
+            ends = np.concatenate([starts[1:], [len(lids)]]) - 1
+            for group_row, top, bottom in zip(group_rows[starts].tolist(), layer_rows[starts].tolist(),
+                                              layer_rows[ends].tolist()):
+                parent = model.index(group_row, 0)
+                selection.select(model.index(top, 0, parent), model.index(bottom, 0, parent))
+        # Cleared first rather than ClearAndSelect, which diffs the old ranges against the new
+        # ones. Without updates the view repaints its visible rows once instead of computing
+        # the area of every range.
+        self.layer_tree.setUpdatesEnabled(False)
+        selection_model = self.layer_tree.selectionModel()
+        selection_model.clearSelection()
+        selection_model.select(selection, QItemSelectionModel.SelectionFlag.Select)
+        self.layer_tree.setUpdatesEnabled(True)
+        return len(lids)
 
-        img_preview_np = np.array(self.current_img)
-        fill_color = [0, 0, 0, 0] if self.replacement_color is None else [
+    def fix_selected_layers(self):
+        self.flush_edits()
+        target_lids = np.flatnonzero(self.layer_model.selected).tolist()
+        if not target_lids or not self.analysis_in_sync: return
+        
+        fill_color = (0, 0, 0, 0) if self.replacement_color is None else (
             self.replacement_color.red(), self.replacement_color.green(),
             self.replacement_color.blue(), self.replacement_color.alpha()
-        ]
-
-        for idx in selected:
-            layer = self.layers[idx]
-            img_preview_np[layer.y, layer.x] = fill_color
-        
-        self.canvas_right.set_image(QPixmap.fromImage(self.pil_to_qimage(Image.fromarray(img_preview_np))), None, reset_view=False)
+        )
 
-    def select_layer_by_id(self, layer_id, add_to_selection=False):
-        root = self.layer_tree.invisibleRootItem()
-        for i in range(root.childCount()):
-            parent = root.child(i)
-            for j in range(parent.childCount()):
-                child = parent.child(j)
-                if child.data(0, Qt.ItemDataRole.UserRole) == layer_id:
-                    if not add_to_selection:
-                        self.layer_tree.clearSelection()
-                    
-                    parent.setSelected(True)
-                    child.setSelected(True)
-                    self.layer_tree.scrollToItem(child)
-                    if self.canvas_left.brush_mode:
-                        self.fix_selected_layers()
-                    
-                    return
+        edits = self.analysis.fix_edits(target_lids, fill_color)
+        if not edits: return
+        xs, ys, _, new = zip(*edits)
+        self.pixels[list(ys), list(xs)] = new
+
+        diff = self.update_analysis([(x, y, new) for x, y, _, new in edits])
+        self.push_history(edits)
+        self.update_edit_views(xs, ys, *diff)
+
+    def fix_all_errors(self):
+        # Fixes every error of the checked categories in the current frame on the worker
+        # thread, pass after pass until none is left (see OutlineAnalysis.fix_all). Until it
+        # is done the frame counts as out of sync: an edit made meanwhile starts a full
+        # analysis, which drops the fix.
+        self.flush_edits()
+        categories = [key for key, button in self.fix_category_buttons.items() if button.isChecked()]
+        if self.pixels is None or not categories or not self.analysis_in_sync: return
+        fill_color = (0, 0, 0, 0) if self.replacement_color is None else (
+            self.replacement_color.red(), self.replacement_color.green(),
+            self.replacement_color.blue(), self.replacement_color.alpha()
+        )
+        self.analysis_generation += 1
+        self.analysis_worker.latest_generation = self.analysis_generation
+        self.fix_all_generation = self.analysis_generation
+        self.analysis_pending = True
+        self.analysis_in_sync = False
+        self.analysis_progress.setValue(0)
+        self.analysis_progress.show()
+        self.btn_cancel_analysis.show()
+        self.analysis_frame = self.frame_index
+        self.fixAllRequested.emit(self.analysis_generation, self.analysis.copy(), categories, fill_color,
+                                  self.spin_cell_size.value())
+
+    def on_fix_all_finished(self, generation, result):
+        # Applies the net edits of a fix-all as one history step, to the frame it ran on.
+        if generation != self.analysis_generation:
+            return
+        analysis, (xs, ys, old, new), report = result
+        self.analysis_pending = False
+        self.analysis_progress.hide()
+        self.btn_cancel_analysis.hide()
+        frame_index, self.analysis_frame = self.analysis_frame, None
+        frame = self.frames[frame_index]
+        if len(xs):
+            # The analysis painted its own copy of the pixels; the document gets the net edits.
+            frame.pixels[ys, xs] = new
+            frame.history.record(xs, ys, old, new)
+        frame.analysis, frame.analysis_in_sync = analysis, True
+        self.update_frame_item(frame_index)
+        self.statusBar().showMessage(LANGUAGES[self.current_lang]["fix_all_status"].format(
+            pixels=report["pixels"], iterations=report["iterations"], remaining=report["remaining"],
+            ms=report["seconds"] * 1000))
+        if frame_index != self.frame_index:
+            if not self.analysis_in_sync:
+                self.analyze_image()
+            return
+        self.analysis = analysis
+        self.analysis_in_sync = True
+        self.rebuild_layer_tree()
+        self.update_canvas_views()
 
-    def fix_selected_layers(self):
-        selected_items = self.layer_tree.selectedItems()
-        target_lids = [item.data(0, Qt.ItemDataRole.UserRole) for item in selected_items if item.data(0, Qt.ItemDataRole.UserRole) is not None]
-        if not target_lids: return
-        
-        color_states, expansion_states, parent_states = self._save_tree_state()
-        selection_state = set(target_lids)
-        
-        selected_parent_colors = set()
-        root = self.layer_tree.invisibleRootItem()
-        for i in range(root.childCount()):
-            parent = root.child(i)
-            if parent.isSelected():
-                color_hex = parent.text(0).split(' ')[0]
-                selected_parent_colors.add(color_hex)
-        
-        img_np = np.array(self.current_img)
-        fill_color = [0, 0, 0, 0] if self.replacement_color is None else [
+    def fix_selection_in_all_frames(self):
+        # Fixes the errors found at the selected positions in every frame, as one history
+        # step per frame. Frames whose analysis is not ready yet are left as they are.
+        self.flush_edits()
+        selected = np.flatnonzero(self.layer_model.selected)
+        if not selected.size or not self.analysis_in_sync: return
+        errors = self.analysis.errors
+        xs, ys = errors.x[selected], errors.y[selected]
+        fill_color = (0, 0, 0, 0) if self.replacement_color is None else (
             self.replacement_color.red(), self.replacement_color.green(),
             self.replacement_color.blue(), self.replacement_color.alpha()
-        ]
+        )
 
-        for lid in target_lids:
-            layer = self.layers[lid]
-            img_np[layer.y, layer.x] = fill_color
+        self.store_frame()
+        for index, frame in enumerate(self.frames):
+            analysis = frame.analysis
+            if not frame.analysis_in_sync or analysis.img_np.shape != self.analysis.img_np.shape:
+                continue
+            edits = analysis.fix_edits(analysis.errors.ids_at(xs, ys), fill_color)
+            if not edits:
+                continue
+            edit_xs, edit_ys, old, new = zip(*edits)
+            frame.pixels[list(edit_ys), list(edit_xs)] = new
+            if len(edits) > INCREMENTAL_EDIT_LIMIT:
+                frame.analysis_in_sync = False
+            else:
+                analysis.update([(x, y, new) for x, y, _, new in edits])
+            frame.history.record(edit_xs, edit_ys, old, new)
+            self.update_frame_item(index)
 
-        self.push_history(Image.fromarray(img_np))
-        
-        self.layer_tree.blockSignals(True)
-        self.analyze_image()
-        self._restore_tree_state(color_states, expansion_states, parent_states)
-        
-        root = self.layer_tree.invisibleRootItem()
-        for i in range(root.childCount()):
-            parent = root.child(i)
-            color_hex = parent.text(0).split(' ')[0]
-            if color_hex in selected_parent_colors:
-                parent.setSelected(True)
-            
-            for j in range(parent.childCount()):
-                child = parent.child(j)
-                lid = child.data(0, Qt.ItemDataRole.UserRole)
-                if lid in selection_state:
-                    child.setSelected(True)
-        
-        self.layer_tree.blockSignals(False)
+        self.load_frame(self.frame_index)
+        self.update_history_status()
+        self.rebuild_layer_tree()
         self.update_canvas_views()
+        if not self.analysis_in_sync:
+            self.analyze_image()
 
-    def pil_to_qimage(self, pil_img):
-        data = pil_img.tobytes("raw", "RGBA")
-        return QImage(data, pil_img.size[0], pil_img.size[1], QImage.Format.Format_RGBA8888)
+    def toggle_profiling(self):
+        PROFILER.enabled = not PROFILER.enabled
+        self.profile_label.setVisible(PROFILER.enabled)
+        if PROFILER.enabled:
+            self.profile_timer.start()
+            self.update_profile_overlay()
+        else:
+            self.profile_timer.stop()
+
+    def update_profile_overlay(self):
+        summary = PROFILER.summary()
+        self.profile_label.setText("  ".join(
+            f"{name} {stat['last_us'] / 1000:.1f}ms" for name, stat in summary.items()))
+        self.profile_label.setToolTip("\n".join(
+            f"{name}: {stat['count']}x, avg {stat['total_us'] / stat['count'] / 1000:.2f}ms, "
+            f"max {stat['max_us'] / 1000:.1f}ms" for name, stat in summary.items()))
+
+    def save_profile_trace(self):
+        path, _ = QFileDialog.getSaveFileName(self, LANGUAGES[self.current_lang]["save_trace"],
+                                              "outlinecheck_trace.json", "JSON (*.json)")
+        if path:
+            PROFILER.dump(path)
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)
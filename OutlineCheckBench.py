@@ -0,0 +1,435 @@
+import argparse
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from collections import deque
+
+import numpy as np
+
+from OutlineCheckCore import (
+    CATEGORY_CODES, OutlineAnalysis, ErrorTable, PaletteImage, CellCache,
+    detect_errors, neighbour_codes, outline_mask
+)
+
+DEFAULT_SIZES = (32, 128, 512, 2048)
+
+# Synthetic sprites
+
+def make_sprite(size, seed=0, staircase=0.3, cluster=0.05, touching=0.2, colors=8):
+    # Deterministic RGBA line-art sprite (size x size, or (h, w)): 1-pixel outlines of
+    # ellipses and diamonds on a transparent background. staircase is the fraction of shapes
+    # outlined with 4-connected lines, whose doubled steps trip the staircase patterns (the
+    # others get clean 8-connected lines). cluster is the chance for each outline pixel to
+    # grow into a 2x2 clump. touching is the fraction of shapes placed against the previous
+    # one so that their outlines meet. Outline colours come from `colors` palette entries.
+    rng = np.random.default_rng(seed)
+    h, w = (size, size) if np.isscalar(size) else size
+    palette = np.concatenate([rng.integers(0, 256, (colors, 3)), np.full((colors, 1), 255)], axis=1).astype(np.uint8)
+    shape_id = np.zeros((h, w), dtype=np.int32)
+    max_radius = max(2, min(h, w, 48) // 3)
+    count = max(1, int(h * w / (2.5 * max_radius ** 2)))
+    y, x = h // 2, w // 2
+    for sid in range(1, count + 1):
+        r = int(rng.integers(2, max_radius + 1))
+        if rng.random() < touching:
+            y = int(np.clip(y + rng.choice([-1, 1]) * (2 * r + 1), 0, h - 1))
+            x = int(np.clip(x + rng.integers(-r, r + 1), 0, w - 1))
+        else:
+            y, x = int(rng.integers(0, h)), int(rng.integers(0, w))
+        y0, y1, x0, x1 = max(y - r, 0), min(y + r + 1, h), max(x - r, 0), min(x + r + 1, w)
+        dy = np.arange(y0, y1)[:, None] - y
+        dx = np.arange(x0, x1)[None, :] - x
+        if rng.random() < 0.5:
+            inside = np.abs(dy) + np.abs(dx) <= r
+        else:
+            ry = max(1, int(r * rng.uniform(0.5, 1.0)))
+            inside = (dy / ry) ** 2 + (dx / r) ** 2 <= 1.0
+        shape_id[y0:y1, x0:x1][inside] = sid
+
+    padded = np.pad(shape_id, 1)
+    differs = [padded[1 + dy:h + 1 + dy, 1 + dx:w + 1 + dx] != shape_id
+               for dy in (-1, 0, 1) for dx in (-1, 0, 1) if dy or dx]
+    edge4 = differs[1] | differs[3] | differs[4] | differs[6]
+    edge8 = edge4 | differs[0] | differs[2] | differs[5] | differs[7]
+    stairs = rng.random(count + 1) < staircase
+    edge = np.where(stairs[shape_id], edge8, edge4) & (shape_id > 0)
+    if cluster:
+        ys, xs = np.nonzero(edge & (rng.random((h, w)) < cluster))
+        for oy, ox in ((0, 1), (1, 0), (1, 1)):
+            ny, nx = np.minimum(ys + oy, h - 1), np.minimum(xs + ox, w - 1)
+            keep = shape_id[ny, nx] == shape_id[ys, xs]
+            edge[ny[keep], nx[keep]] = True
+
+    img = np.zeros((h, w, 4), dtype=np.uint8)
+    line = rng.integers(0, colors, count + 1)
+    img[edge] = palette[line[shape_id[edge]]]
+    return img
+
+# Reference implementation: a Qt-free port of the original per-pixel loops, kept as the
+# ground truth for the conformance check. Far too slow for anything but small sprites.
+
+REF_CL = [np.rot90(np.array([[2, 1, 1], [2, 3, 1], [2, 2, 2]]), k) for k in range(4)] + \
+         [np.rot90(np.array([[1, 1, 2], [1, 3, 2], [2, 2, 2]]), k) for k in range(4)]
+REF_BAD = [np.rot90(np.array([[2, 1, 0], [2, 3, 1], [0, 2, 2]]), k) for k in range(4)]
+REF_OT = [np.rot90(np.array([[2, 1, 0], [2, 3, 1], [0, 1, 2]]), k) for k in range(4)] + \
+         [np.rot90(np.array([[2, 1, 0], [1, 3, 1], [0, 2, 2]]), k) for k in range(4)]
+REF_OSC = [np.rot90(np.array([[2, 4, 0], [2, 3, 2], [0, 2, 2]]), k) for k in range(4)] + \
+          [np.rot90(np.array([[2, 2, 0], [2, 3, 4], [0, 2, 2]]), k) for k in range(4)]
+REF_SC = [np.rot90(np.array([[2, 4, 0], [2, 3, 4], [0, 2, 2]]), k) for k in range(4)]
+
+def _ref_match_detect(pattern, sub_mask):
+    for r in range(3):
+        for c in range(3):
+            p_val = pattern[r, c]
+            m_val = sub_mask[r, c]
+            if (p_val == 3 or p_val == 1) and not m_val:
+                return False
+            if p_val == 0 and m_val:
+                return False
+    return True
+
+def _ref_match_category(pattern, color_mask, bad_mask):
+    for r in range(3):
+        for c in range(3):
+            p_val = pattern[r, c]
+            if p_val == 2 or p_val == 3:
+                continue
+            color_val = color_mask[r, c]
+            if p_val == 1 and not color_val:
+                return False
+            if p_val == 0 and color_val:
+                return False
+            if p_val == 4 and (not color_val or not bad_mask[r, c]):
+                return False
+    return True
+
+def reference_errors(img_np):
+    # [(x, y, rgba, category)] in the order the original tool created its layers.
+    h, w, _ = img_np.shape
+    color_count = {}
+    for y in range(1, h - 1):
+        for x in range(1, w - 1):
+            color = tuple(int(c) for c in img_np[y, x])
+            if color[3] < 10:
+                continue
+            sub_mask = np.all(img_np[y - 1:y + 2, x - 1:x + 2] == color, axis=-1)
+            if any(_ref_match_detect(rot, sub_mask) for rot in REF_CL):
+                color_count.setdefault(color, []).append([x, y, color, "CL"])
+            elif any(_ref_match_detect(rot, sub_mask) for rot in REF_BAD):
+                color_count.setdefault(color, []).append([x, y, color, "OT"])
+    layers = [layer for pixels in color_count.values() for layer in pixels]
+
+    bad_pixel_mask = np.zeros((h, w), dtype=bool)
+    for x, y, _, _ in layers:
+        bad_pixel_mask[y, x] = True
+    for layer in layers:
+        x, y, color, category = layer
+        if category == "CL":
+            continue
+        if y < 1 or y >= h - 1 or x < 1 or x >= w - 1:
+            layer[3] = "CR"
+            continue
+        color_mask = np.all(img_np[y - 1:y + 2, x - 1:x + 2] == color, axis=-1)
+        bad_mask = color_mask & bad_pixel_mask[y - 1:y + 2, x - 1:x + 2]
+        if any(_ref_match_category(rot, color_mask, bad_mask) for rot in REF_OSC):
+            layer[3] = "OSC"
+            if any(_ref_match_category(rot, color_mask, bad_mask) for rot in REF_SC):
+                layer[3] = "SC"
+        elif any(_ref_match_category(rot, color_mask, bad_mask) for rot in REF_OT):
+            layer[3] = "OT"
+        else:
+            layer[3] = "CR"
+
+    pos_to_layer = {(layer[0], layer[1]): layer for layer in layers}
+    queue = deque(layer for layer in layers if layer[3] == "SC")
+    while queue:
+        x, y, _, _ = queue.popleft()
+        for dy in (-1, 0, 1):
+            for dx in (-1, 0, 1):
+                neighbor = pos_to_layer.get((x + dx, y + dy))
+                if neighbor is not None and neighbor[3] in ("OSC", "OT", "CR"):
+                    neighbor[3] = "SC"
+                    queue.append(neighbor)
+    return [tuple(layer) for layer in layers]
+
+def analysis_errors(analysis):
+    errors = analysis.errors
+    return [(int(errors.x[i]), int(errors.y[i]), tuple(int(c) for c in errors.color_of(i)), errors.category_of(i))
+            for i in errors.live_ids().tolist()]
+
+def check_conformance(img_np, tile_size=16):
+    # Names of the optimized paths whose errors differ from reference_errors().
+    expected = reference_errors(img_np)
+    paths = {
+        "analyze": lambda: OutlineAnalysis().analyze(img_np.copy()),
+        "tiled": lambda: OutlineAnalysis().analyze_tiled(img_np.copy(), tile_size),
+        "cells": lambda: OutlineAnalysis().analyze(img_np.copy(), tile_size=tile_size, cell_cache=CellCache()),
+    }
+    failed = [name for name, run in paths.items() if analysis_errors(run()) != expected]
+    # Incremental updates are compared as sets: ids of re-detected errors change order.
+    analysis = OutlineAnalysis().analyze(img_np.copy())
+    fixed = img_np.copy()
+    ids = analysis.errors.live_ids()[::7]
+    edits = analysis.fix_edits(ids, (0, 0, 0, 0))
+    if edits:
+        analysis.update([(x, y, new) for x, y, _, new in edits])
+        xs, ys, _, new = zip(*edits)
+        fixed[list(ys), list(xs)] = new
+        if sorted(analysis_errors(analysis)) != sorted(reference_errors(fixed)):
+            failed.append("update")
+    return failed
+
+# Stages
+
+def stage_palette(img_np):
+    palette = PaletteImage(img_np)
+    np.bincount(palette.index[outline_mask(img_np)], minlength=len(palette))
+    return palette
+
+def stage_pattern_scan(img_np, palette):
+    codes = neighbour_codes(palette.index)
+    return codes, detect_errors(img_np, palette.index, codes)
+
+def stage_categorize(img_np, palette, codes, detected):
+    xs, ys, is_cluster = detected
+    analysis = OutlineAnalysis()
+    analysis.img_np, analysis.palette = img_np, palette
+    analysis.errors = ErrorTable(img_np.shape[:2], palette)
+    analysis.errors.add(xs, ys, palette.index[ys, xs], np.where(is_cluster, CATEGORY_CODES["CL"], CATEGORY_CODES["OT"]))
+    analysis.categorize_errors(img_np, analysis.errors.label >= 0, codes)
+    return analysis
+
+def stage_fix(analysis, limit):
+    # fix_selected_layers() without the GUI: fix up to limit staircase errors in place.
+    errors = analysis.errors
+    ids = np.flatnonzero(errors.live & (errors.category == CATEGORY_CODES["SC"]))[:limit]
+    edits = analysis.fix_edits(ids, (0, 0, 0, 0))
+    if edits:
+        analysis.update([(x, y, new) for x, y, _, new in edits])
+    return len(edits)
+
+def stage_region_query(analysis):
+    # A lasso over the central diamond of the sprite, as the GUI region selection queries it.
+    h, w = analysis.errors.label.shape
+    return analysis.errors.query(polygon=[(w / 2, 0), (w, h / 2), (w / 2, h), (0, h / 2)])
+
+def measure(run, repeat, memory, setup=None):
+    # (best wall time in seconds, peak traced bytes or None, result of the last run). setup()
+    # runs untimed before every run and its result is passed to run.
+    setup = setup or (lambda: None)
+    best = float("inf")
+    for _ in range(repeat):
+        state = setup()
+        gc.collect()
+        start = time.perf_counter()
+        result = run() if state is None else run(state)
+        best = min(best, time.perf_counter() - start)
+    peak = None
+    if memory:
+        state = setup()
+        result = None
+        gc.collect()
+        tracemalloc.start()
+        try:
+            result = run() if state is None else run(state)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return best, peak, result
+
+class GuiStages:
+    # Tree rebuild, update_canvas_views, a selection patch, a region selection and a paint of
+    # both canvases in an offscreen window.
+    def __init__(self):
+        os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+        from PyQt6.QtWidgets import QApplication
+        import OutlineCheck
+        self.module = OutlineCheck
+        self.app = QApplication.instance() or QApplication([])
+        self.window = OutlineCheck.OutlineCheckApp()
+        self.window.resize(1400, 950)
+        self.window.show()
+
+    def load(self, img_np, analysis):
+        window = self.window
+        window.frames = [self.module.AnimationFrame(img_np.copy())]
+        window.load_frame(0)
+        window.analysis, window.analysis_in_sync = analysis, True
+        window.store_frame()
+
+    def select_sample(self, limit):
+        model = self.window.layer_model
+        model.selected[:] = False
+        model.selected[self.window.analysis.errors.live_ids()[:limit]] = True
+
+    def selection_delta(self, limit):
+        # Nothing selected and the views fully refreshed, then limit layers selected: the
+        # state update_selection_views patches from, and the ids it is given.
+        self.select_sample(0)
+        self.window.update_canvas_views()
+        self.select_sample(limit)
+        return self.window, self.window.analysis.errors.live_ids()[:limit]
+
+    def clear_selection(self):
+        self.window.layer_tree.selectionModel().clearSelection()
+        return self.window
+
+    def paint(self):
+        self.window.canvas_left.grab()
+        self.window.canvas_right.grab()
+
+    def close(self):
+        self.window.close()
+
+def run_case(size, seed, args, gui):
+    img_np = make_sprite(size, seed, args.staircase, args.cluster, args.touching, args.colors)
+    h, w, _ = img_np.shape
+    stages = {}
+
+    def record(name, run, setup=None):
+        seconds, peak, result = measure(run, args.repeat, args.memory, setup)
+        stages[name] = {"seconds": seconds, "peak_bytes": peak}
+        return result
+
+    palette = record("palette", lambda: stage_palette(img_np))
+    codes, detected = record("pattern_scan", lambda: stage_pattern_scan(img_np, palette))
+    record("categorize", lambda: stage_categorize(img_np, palette, codes, detected))
+    analysis = record("analyze", lambda: OutlineAnalysis().analyze(img_np.copy()))
+    counts = analysis.category_counts()
+    fixed = record("fix", lambda fresh: stage_fix(fresh, args.fix_limit), lambda: analysis.copy())
+    region = record("region_query", lambda: stage_region_query(analysis))
+    if gui is not None and h * w <= args.gui_max ** 2:
+        gui.load(img_np, analysis)
+        record("tree_rebuild", gui.window.rebuild_layer_tree)
+        gui.select_sample(args.fix_limit)
+        record("update_canvas_views", gui.window.update_canvas_views)
+        record("selection_patch", lambda state: state[0].update_selection_views(state[1]),
+               lambda: gui.selection_delta(args.fix_limit))
+        record("region_select", lambda window: window.select_layers(region), gui.clear_selection)
+        record("paint", gui.paint)
+    return {
+        "size": [h, w], "seed": seed, "pixels": h * w,
+        "staircase": args.staircase, "cluster": args.cluster, "touching": args.touching,
+        "errors": counts, "fixed_pixels": fixed, "stages": stages,
+    }
+
+def git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return out.stdout.strip() or None
+
+def print_results(results, out=sys.stdout):
+    names = []
+    for result in results:
+        names += [name for name in result["stages"] if name not in names]
+    print(f"{'SIZE':>11}{'ERRORS':>9}" + "".join(f"{name[:12]:>14}" for name in names), file=out)
+    for result in results:
+        h, w = result["size"]
+        cells = []
+        for name in names:
+            stage = result["stages"].get(name)
+            if stage is None:
+                cells.append(f"{'-':>14}")
+            else:
+                text = f"{stage['seconds'] * 1000:.1f}ms"
+                if stage["peak_bytes"] is not None:
+                    text += f"/{stage['peak_bytes'] / (1024 * 1024):.0f}M"
+                cells.append(f"{text:>14}")
+        print(f"{f'{h}x{w}':>11}{sum(result['errors'].values()):>9}" + "".join(cells), file=out)
+
+def compare(results, baseline, threshold, out=sys.stdout):
+    # Prints time ratios against a previous run; returns the stages slower than threshold.
+    old = {(tuple(r["size"]), r["seed"]): r for r in baseline["results"]}
+    slower = []
+    print(f"compared with {baseline['meta'].get('commit') or 'baseline'} (new / old time):", file=out)
+    for result in results:
+        before = old.get((tuple(result["size"]), result["seed"]))
+        if before is None:
+            continue
+        h, w = result["size"]
+        ratios = []
+        for name, stage in result["stages"].items():
+            if name not in before["stages"] or before["stages"][name]["seconds"] <= 0:
+                continue
+            ratio = stage["seconds"] / before["stages"][name]["seconds"]
+            ratios.append(f"{name} {ratio:.2f}")
+            if ratio > threshold:
+                slower.append((f"{h}x{w}", name, ratio))
+        print(f"  {h}x{w}: " + ", ".join(ratios), file=out)
+    return slower
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="OutlineCheckBench",
+        description="Time detection, categorization, fixing and rendering on synthetic sprites.")
+    parser.add_argument("--sizes", type=lambda v: [int(s) for s in v.split(",")], default=list(DEFAULT_SIZES),
+                        help="comma-separated sprite sizes (default: %(default)s, up to 8192 for atlases)")
+    parser.add_argument("--seeds", type=int, default=1, help="sprites per size (default: 1)")
+    parser.add_argument("--staircase", type=float, default=0.3, help="fraction of diamond shapes (default: 0.3)")
+    parser.add_argument("--cluster", type=float, default=0.05, help="outline clump probability (default: 0.05)")
+    parser.add_argument("--touching", type=float, default=0.2, help="fraction of touching shapes (default: 0.2)")
+    parser.add_argument("--colors", type=int, default=8, help="fill and outline colours each (default: 8)")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per stage, the best is kept (default: 3)")
+    parser.add_argument("--fix-limit", type=int, default=1000, help="errors fixed by the fix stage (default: 1000)")
+    parser.add_argument("--no-memory", dest="memory", action="store_false", help="skip the peak memory runs")
+    parser.add_argument("--no-gui", dest="gui", action="store_false", help="skip the Qt stages")
+    parser.add_argument("--gui-max", type=int, default=2048, help="largest size for the Qt stages (default: 2048)")
+    parser.add_argument("--check", action="store_true", help="compare against the reference implementation")
+    parser.add_argument("--check-max", type=int, default=128, help="largest size checked (default: 128)")
+    parser.add_argument("--json", dest="json_path", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="print time ratios against this earlier JSON result")
+    parser.add_argument("--threshold", type=float, default=1.25,
+                        help="with --compare, exit with status 1 when a stage is this much slower (default: 1.25)")
+    args = parser.parse_args(argv)
+
+    status = 0
+    if args.check:
+        for size in [s for s in args.sizes if s <= args.check_max] or [min(args.sizes)]:
+            for seed in range(args.seeds):
+                failed = check_conformance(make_sprite(size, seed, args.staircase, args.cluster, args.touching,
+                                                       args.colors))
+                print(f"conformance {size}x{size} seed {seed}: {'FAILED ' + ', '.join(failed) if failed else 'ok'}")
+                status |= bool(failed)
+
+    gui = None
+    if args.gui:
+        try:
+            gui = GuiStages()
+        except ImportError as exc:
+            print(f"skipping Qt stages: {exc}", file=sys.stderr)
+    results = []
+    try:
+        for size in args.sizes:
+            for seed in range(args.seeds):
+                results.append(run_case(size, seed, args, gui))
+    finally:
+        if gui is not None:
+            gui.close()
+
+    print_results(results)
+    meta = {
+        "commit": git_commit(), "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "platform": platform.platform(),
+        "python": platform.python_version(), "numpy": np.__version__, "cpus": os.cpu_count(),
+        "repeat": args.repeat,
+    }
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump({"meta": meta, "results": results}, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            slower = compare(results, json.load(f), args.threshold)
+        for size, name, ratio in slower:
+            print(f"regression: {name} at {size} is {ratio:.2f}x slower")
+        status |= bool(slower)
+    return status
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,224 @@
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+from PIL import Image
+
+from OutlineCheckCore import (
+    AUTO_TILE_PIXELS, CATEGORY_KEYS, FIX_ALL_ITERATIONS, PROFILER, TILE_SIZE, AnalysisCache, CellCache,
+    analyze_frames, load_frames
+)
+
+IMAGE_EXTENSIONS = (".png", ".apng", ".gif", ".bmp")
+
+def parse_fill(value):
+    if value.lower() in ("transparent", "none"):
+        return (0, 0, 0, 0)
+    hex_value = value.lstrip("#")
+    if len(hex_value) not in (6, 8):
+        raise argparse.ArgumentTypeError(f"invalid colour '{value}', expected #rrggbb, #rrggbbaa or 'transparent'")
+    try:
+        channels = [int(hex_value[i:i + 2], 16) for i in range(0, len(hex_value), 2)]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid colour '{value}'")
+    return tuple(channels + [255] * (4 - len(channels)))
+
+def parse_cell_size(value):
+    try:
+        sizes = [int(v) for v in value.lower().split("x")]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid cell size '{value}', expected N or HxW")
+    if len(sizes) not in (1, 2) or min(sizes) < 1:
+        raise argparse.ArgumentTypeError(f"invalid cell size '{value}', expected N or HxW")
+    return sizes[0] if len(sizes) == 1 else tuple(sizes)
+
+def parse_categories(value):
+    keys = [key.strip().upper() for key in value.split(",") if key.strip()]
+    unknown = [key for key in keys if key not in CATEGORY_KEYS]
+    if unknown or not keys:
+        raise argparse.ArgumentTypeError(f"invalid categories '{value}', expected a list of {','.join(CATEGORY_KEYS)}")
+    return tuple(keys)
+
+def find_images(paths, recursive):
+    # (path, path relative to the given input) for every image found.
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            if recursive:
+                for root, dirs, names in os.walk(path):
+                    dirs.sort()
+                    for name in sorted(names):
+                        if name.lower().endswith(IMAGE_EXTENSIONS):
+                            full = os.path.join(root, name)
+                            files.append((full, os.path.relpath(full, path)))
+            else:
+                for name in sorted(os.listdir(path)):
+                    full = os.path.join(path, name)
+                    if name.lower().endswith(IMAGE_EXTENSIONS) and os.path.isfile(full):
+                        files.append((full, name))
+        else:
+            files.append((path, os.path.basename(path)))
+    return files
+
+def fix_output_path(fix_dir, rel_path):
+    # PNG (APNG for animations) written for rel_path: the source extension is kept unless it is
+    # already .png, so that a.png, a.bmp and a.gif do not overwrite each other.
+    if os.path.splitext(rel_path)[1].lower() == ".png":
+        rel_path = os.path.splitext(rel_path)[0]
+    return os.path.join(fix_dir, rel_path + ".png")
+
+# One cache per worker process, shared by the files it handles so that palette swaps of a
+# sprite are analyzed once per process (and once overall with --cache-dir).
+_caches = {}
+
+def process_file(path, rel_path, fix_dir, fill_color, tile_size=None, tile_workers=None, cache_dir=None,
+                 cell_size=None, fix_categories=CATEGORY_KEYS, fix_iterations=1):
+    # Rows (name, counts, memory_report, fix_report) for the file, one per frame of an
+    # animation (named path[frame]), whether every full analysis came from the cache, and the
+    # error that kept the file from being read (None when it was). fix_report is the
+    # OutlineAnalysis.fix_all() report, None without fix_dir.
+    try:
+        frames, durations = load_frames([path])
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError) as exc:
+        return [], False, f"{path}: {exc}"
+    cache = _caches.get(cache_dir)
+    if cache is None:
+        cache = _caches[cache_dir] = AnalysisCache(cache_dir=cache_dir)
+    misses = cache.misses
+    if cell_size:
+        kwargs = {"tile_size": cell_size, "workers": tile_workers, "cell_cache": CellCache()}
+    else:
+        kwargs = {"tile_size": tile_size, "workers": tile_workers}
+    analyses = analyze_frames(frames, cache=cache, **kwargs)
+    if len(analyses) == 1:
+        names = [path]
+    else:
+        names = [f"{path}[{i}]" for i in range(len(analyses))]
+    counts = [analysis.category_counts() for analysis in analyses]
+    memory = [analysis.errors.memory_report() for analysis in analyses]
+    fix_reports = [None] * len(analyses)
+    if fix_dir:
+        fixed = []
+        for i, analysis in enumerate(analyses):
+            # fix_all() paints analysis.img_np in place, which is the frame array or a copy of it.
+            _, fix_reports[i] = analysis.fix_all(fix_categories, fill_color, fix_iterations, **kwargs)
+            fixed.append(Image.fromarray(analysis.img_np))
+        out_path = fix_output_path(fix_dir, rel_path)
+        os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+        if len(fixed) == 1:
+            fixed[0].save(out_path)
+        else:
+            fixed[0].save(out_path, save_all=True, append_images=fixed[1:], duration=durations, loop=0)
+    return list(zip(names, counts, memory, fix_reports)), cache.misses == misses, None
+
+def print_report(results, out=sys.stdout):
+    name_width = max([len("FILE")] + [len(path) for path, _ in results])
+    header = f"{'FILE':<{name_width}}" + "".join(f"{key:>7}" for key in CATEGORY_KEYS) + f"{'TOTAL':>8}"
+    print(header, file=out)
+    totals = dict.fromkeys(CATEGORY_KEYS, 0)
+    for path, counts in results:
+        for key in CATEGORY_KEYS:
+            totals[key] += counts[key]
+        row = f"{path:<{name_width}}" + "".join(f"{counts[key]:>7}" for key in CATEGORY_KEYS)
+        print(row + f"{sum(counts.values()):>8}", file=out)
+    print("-" * len(header), file=out)
+    print(f"{'TOTAL':<{name_width}}" + "".join(f"{totals[key]:>7}" for key in CATEGORY_KEYS)
+          + f"{sum(totals.values()):>8}", file=out)
+
+def print_memory_report(results, out=sys.stdout):
+    # Size of each file's error table and label image, as kept by the analysis.
+    name_width = max([len("FILE")] + [len(path) for path, _ in results])
+    print(f"{'FILE':<{name_width}}{'ERRORS':>9}{'TABLE KB':>10}{'LABELS KB':>11}", file=out)
+    for path, memory in results:
+        print(f"{path:<{name_width}}{memory['errors']:>9}{memory['table_bytes'] / 1024:>10.1f}"
+              f"{memory['label_bytes'] / 1024:>11.1f}", file=out)
+
+def print_fix_report(results, out=sys.stdout):
+    # Passes, pixels painted, errors of the fixed categories left and time of each fix.
+    name_width = max([len("FILE")] + [len(path) for path, _ in results])
+    print(f"{'FILE':<{name_width}}{'PASSES':>8}{'PIXELS':>9}{'LEFT':>7}{'MS':>9}", file=out)
+    for path, report in results:
+        print(f"{path:<{name_width}}{report['iterations']:>8}{report['pixels']:>9}{report['remaining']:>7}"
+              f"{report['seconds'] * 1000:>9.1f}", file=out)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="OutlineCheckCLI",
+        description="Count outline errors (OT/SC/OSC/CR/CL) in sprite files without a display.")
+    parser.add_argument("paths", nargs="+", help="PNG/APNG/GIF/BMP files or directories")
+    parser.add_argument("-r", "--recursive", action="store_true", help="search directories recursively")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="worker processes (default: all cores)")
+    parser.add_argument("--fix-dir", help="write auto-fixed PNGs (APNGs for animations) to this directory")
+    parser.add_argument("--fill", type=parse_fill, default=(0, 0, 0, 0),
+                        help="replacement colour for fixed pixels: #rrggbb[aa] or 'transparent' (default)")
+    parser.add_argument("--fix-categories", type=parse_categories, default=CATEGORY_KEYS,
+                        help="categories fixed with --fix-dir, e.g. SC,OT (default: all)")
+    parser.add_argument("--fix-iterations", type=int, default=1,
+                        help="fix and re-analyze up to this many times, as fixes can expose new errors "
+                             f"(default: 1, {FIX_ALL_ITERATIONS} is usually enough to reach a fixed point)")
+    parser.add_argument("--json", dest="json_path", help="also write per-file counts to this JSON file")
+    parser.add_argument("--tile-size", type=int,
+                        help=f"analyze in tiles of this size (default: {TILE_SIZE} above {AUTO_TILE_PIXELS} pixels)")
+    parser.add_argument("--cell-size", type=parse_cell_size,
+                        help="sprite-sheet mode: analyze cells of N or HxW pixels once per distinct content")
+    parser.add_argument("--cache-dir", help="reuse analyses of unchanged files stored in this directory")
+    parser.add_argument("--memory", action="store_true", help="also print the memory used by each error table")
+    parser.add_argument("--profile", help="write a Chrome trace of the analysis phases to this JSON file "
+                                          "(files are then processed in this process)")
+    args = parser.parse_args(argv)
+
+    missing = [path for path in args.paths if not os.path.exists(path)]
+    if missing:
+        parser.error("no such file or directory: " + ", ".join(missing))
+    files = find_images(args.paths, args.recursive)
+    if not files:
+        parser.error("no images found")
+
+    paths, rel_paths = zip(*files)
+    if args.fix_dir:
+        outputs = {}
+        for path, rel_path in files:
+            outputs.setdefault(fix_output_path(args.fix_dir, rel_path), []).append(path)
+        clashes = [sources for sources in outputs.values() if len(sources) > 1]
+        if clashes:
+            parser.error("several inputs would be fixed into the same file: "
+                         + "; ".join(", ".join(sources) for sources in clashes))
+    parallel_files = args.jobs > 1 and len(files) > 1 and not args.profile
+    PROFILER.enabled = PROFILER.enabled or bool(args.profile)
+    # Tiles of one file share the cores only when files are not already spread over processes.
+    tile_workers = 1 if parallel_files else args.jobs
+    worker_args = (paths, rel_paths, repeat(args.fix_dir), repeat(args.fill),
+                   repeat(args.tile_size), repeat(tile_workers), repeat(args.cache_dir), repeat(args.cell_size),
+                   repeat(args.fix_categories), repeat(args.fix_iterations))
+    if parallel_files:
+        with ProcessPoolExecutor(max_workers=min(args.jobs, len(files))) as pool:
+            results = list(pool.map(process_file, *worker_args, chunksize=max(1, len(files) // (args.jobs * 4))))
+    else:
+        results = list(map(process_file, *worker_args))
+
+    failed = [error for _, _, error in results if error]
+    for error in failed:
+        print(f"error: {error}", file=sys.stderr)
+    rows = [row for file_rows, _, _ in results for row in file_rows]
+    print_report([(name, counts) for name, counts, _, _ in rows])
+    if args.memory:
+        print()
+        print_memory_report([(name, memory) for name, _, memory, _ in rows])
+    if args.fix_dir:
+        print()
+        print_fix_report([(name, report) for name, _, _, report in rows])
+    reused = sum(cached for _, cached, _ in results)
+    if args.cache_dir or reused:
+        print(f"cache: {reused} of {len(results) - len(failed)} files reused")
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump({name: counts for name, counts, _, _ in rows}, f, indent=2)
+    if args.profile:
+        PROFILER.dump(args.profile)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,1212 @@
+import contextlib
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import zipfile
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+from PIL import Image, ImageSequence
+
+NEIGHBOUR_OFFSETS = [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)]
+
+# Pattern cells: 0 = different colour, 1 = same colour, 2 = don't care, 3 = centre,
+# 4 = same colour and already flagged as a bad pixel.
+CL_PATTERNS = [np.rot90(np.array([[2, 1, 1], [2, 3, 1], [2, 2, 2]]), k) for k in range(4)] + \
+              [np.rot90(np.array([[1, 1, 2], [1, 3, 2], [2, 2, 2]]), k) for k in range(4)]
+BAD_PATTERNS = [np.rot90(np.array([[2, 1, 0], [2, 3, 1], [0, 2, 2]]), k) for k in range(4)]
+OT_PATTERNS = [np.rot90(np.array([[2, 1, 0], [2, 3, 1], [0, 1, 2]]), k) for k in range(4)] + \
+              [np.rot90(np.array([[2, 1, 0], [1, 3, 1], [0, 2, 2]]), k) for k in range(4)]
+OSC_PATTERNS = [np.rot90(np.array([[2, 4, 0], [2, 3, 2], [0, 2, 2]]), k) for k in range(4)] + \
+               [np.rot90(np.array([[2, 2, 0], [2, 3, 4], [0, 2, 2]]), k) for k in range(4)]
+SC_PATTERNS = [np.rot90(np.array([[2, 4, 0], [2, 3, 4], [0, 2, 2]]), k) for k in range(4)]
+
+CATEGORY_KEYS = ("OT", "SC", "OSC", "CR", "CL")
+CATEGORY_CODES = {key: code for code, key in enumerate(CATEGORY_KEYS)}
+
+def compile_pattern_lut(patterns):
+    # Index is same_code | bad_code << 8: bit i of same_code is set when neighbour
+    # NEIGHBOUR_OFFSETS[i] shares the centre colour, bit i of bad_code when it is also a bad pixel.
+    index = np.arange(1 << 16)
+    lut = np.zeros(1 << 16, dtype=bool)
+    for pattern in patterns:
+        match = np.ones(1 << 16, dtype=bool)
+        for bit, (dy, dx) in enumerate(NEIGHBOUR_OFFSETS):
+            p_val = pattern[1 + dy, 1 + dx]
+            same = (index >> bit) & 1 == 1
+            bad = (index >> (bit + 8)) & 1 == 1
+            if p_val == 1:
+                match &= same
+            elif p_val == 0:
+                match &= ~same
+            elif p_val == 4:
+                match &= same & bad
+        lut |= match
+    return lut
+
+CL_LUT = compile_pattern_lut(CL_PATTERNS)
+BAD_LUT = compile_pattern_lut(BAD_PATTERNS)
+OT_LUT = compile_pattern_lut(OT_PATTERNS)
+OSC_LUT = compile_pattern_lut(OSC_PATTERNS)
+SC_LUT = compile_pattern_lut(SC_PATTERNS)
+
+# DETECT_LUT[same_code]: 0 = no error, 1 = BAD, 2 = CL.
+DETECT_LUT = np.where(CL_LUT[:256], 2, np.where(BAD_LUT[:256], 1, 0)).astype(np.uint8)
+# CATEGORY_LUT[same_code | bad_code << 8]: category code of a non-CL bad pixel.
+CATEGORY_LUT = np.where(
+    OSC_LUT,
+    np.where(SC_LUT, CATEGORY_CODES["SC"], CATEGORY_CODES["OSC"]),
+    np.where(OT_LUT, CATEGORY_CODES["OT"], CATEGORY_CODES["CR"])
+).astype(np.uint8)
+
+def neighbour_codes(index):
+    # Same-colour neighbour code of every pixel of a colour-index plane (palette indices or
+    # packed RGBA). Border pixels are left at 0, they are never candidates.
+    h, w = index.shape
+    codes = np.zeros((h, w), dtype=np.uint8)
+    if h < 3 or w < 3:
+        return codes
+    centre = index[1:-1, 1:-1]
+    inner = codes[1:-1, 1:-1]
+    for bit, (dy, dx) in enumerate(NEIGHBOUR_OFFSETS):
+        inner |= (index[1 + dy:h - 1 + dy, 1 + dx:w - 1 + dx] == centre).astype(np.uint8) << bit
+    return codes
+
+def bad_neighbour_codes(codes, bad_pixel_mask):
+    h, w = codes.shape
+    bad_codes = np.zeros((h, w), dtype=np.uint8)
+    if h < 3 or w < 3:
+        return bad_codes
+    inner = bad_codes[1:-1, 1:-1]
+    for bit, (dy, dx) in enumerate(NEIGHBOUR_OFFSETS):
+        inner |= bad_pixel_mask[1 + dy:h - 1 + dy, 1 + dx:w - 1 + dx].astype(np.uint8) << bit
+    return bad_codes & codes
+
+def detection_plane(img_np, codes):
+    # 0 = no error, 1 = BAD, 2 = CL for every pixel of img_np.
+    detected = DETECT_LUT[codes]
+    detected[img_np[:, :, 3] < 10] = 0
+    detected[[0, -1], :] = 0
+    detected[:, [0, -1]] = 0
+    return detected
+
+def pack_rgba(pixels):
+    # (..., 4) uint8 RGBA -> (...) uint32, one integer per colour.
+    px = pixels.astype(np.uint32)
+    return (px[..., 0] << 24) | (px[..., 1] << 16) | (px[..., 2] << 8) | px[..., 3]
+
+def unpack_rgba(keys):
+    keys = np.asarray(keys, dtype=np.uint32)
+    return np.stack([keys >> 24, (keys >> 16) & 255, (keys >> 8) & 255, keys & 255], axis=-1).astype(np.uint8)
+
+class PaletteImage:
+    # Colour-index plane of an RGBA image plus its palette table, so colour equality is
+    # integer equality. Indices are uint16 while the palette fits, uint32 beyond. The
+    # initial palette is sorted by RGBA; colours added by later edits are appended.
+    def __init__(self, img_np):
+        # Sprites are mostly runs of one colour, so only the first pixel of each run is sorted.
+        packed = pack_rgba(img_np).reshape(-1)
+        run_start = np.ones(packed.size, dtype=bool)
+        run_start[1:] = packed[1:] != packed[:-1]
+        starts = np.flatnonzero(run_start)
+        keys, inverse = np.unique(packed[starts], return_inverse=True)
+        self.colors = [tuple(color) for color in unpack_rgba(keys).tolist()]
+        self.color_ids = {key: i for i, key in enumerate(keys.tolist())}
+        dtype = np.uint16 if len(keys) <= 1 << 16 else np.uint32
+        run_lengths = np.diff(np.append(starts, packed.size))
+        self.index = np.repeat(inverse.reshape(-1).astype(dtype), run_lengths).reshape(img_np.shape[:2])
+
+    @classmethod
+    def from_keys(cls, keys, shape):
+        # Palette of the sorted packed colours keys, with an index plane of shape left for the caller to fill.
+        palette = cls.__new__(cls)
+        palette.colors = [tuple(color) for color in unpack_rgba(keys).tolist()]
+        palette.color_ids = {key: i for i, key in enumerate(keys.tolist())}
+        palette.index = np.zeros(shape, dtype=np.uint16 if len(keys) <= 1 << 16 else np.uint32)
+        return palette
+
+    def __len__(self):
+        return len(self.colors)
+
+    def intern(self, pixels):
+        # Palette index of each RGBA row of pixels, appending colours not seen yet.
+        keys, inverse = np.unique(pack_rgba(np.asarray(pixels, dtype=np.uint8).reshape(-1, 4)), return_inverse=True)
+        ids = np.empty(len(keys), dtype=np.uint32)
+        for i, key in enumerate(keys.tolist()):
+            color_id = self.color_ids.get(key)
+            if color_id is None:
+                color_id = self.color_ids[key] = len(self.colors)
+                self.colors.append(tuple(unpack_rgba(key).tolist()))
+            ids[i] = color_id
+        if len(self.colors) > 1 << 16 and self.index.dtype == np.uint16:
+            self.index = self.index.astype(np.uint32)
+        return ids[inverse.reshape(-1)]
+
+    def set_pixels(self, xs, ys, pixels):
+        self.index[ys, xs] = self.intern(pixels)
+
+    def first_appearance(self):
+        # Palette ids ordered by their first pixel (row-major); colours no longer in the plane come last.
+        flat = self.index.reshape(-1)
+        first = np.full(len(self.colors), flat.size, dtype=np.int64)
+        step = 1 << 20
+        for start in range(0, flat.size, step):
+            chunk = flat[start:start + step]
+            np.minimum.at(first, chunk, np.arange(start, start + chunk.size))
+        return np.argsort(first, kind="stable")
+
+    def copy(self):
+        palette = PaletteImage.__new__(PaletteImage)
+        palette.colors = list(self.colors)
+        palette.color_ids = dict(self.color_ids)
+        palette.index = self.index.copy()
+        return palette
+
+def detect_errors(img_np, index, codes=None):
+    # (xs, ys, is_cluster) of every error pixel, grouped by colour in order of first
+    # appearance (row-major) and row-major inside a colour, like the per-pixel scan did.
+    h, w, _ = img_np.shape
+    empty = np.zeros(0, dtype=np.intp)
+    if h < 3 or w < 3:
+        return empty, empty, np.zeros(0, dtype=bool)
+    if codes is None:
+        codes = neighbour_codes(index)
+    detected = detection_plane(img_np, codes)
+
+    ys, xs = np.nonzero(detected)
+    if ys.size == 0:
+        return empty, empty, np.zeros(0, dtype=bool)
+    _, first_idx, inverse = np.unique(index[ys, xs], return_index=True, return_inverse=True)
+    rank = np.argsort(np.argsort(first_idx))
+    order = np.argsort(rank[inverse.reshape(-1)], kind="stable")
+    xs, ys = xs[order], ys[order]
+    return xs, ys, detected[ys, xs] == 2
+
+NO_ERROR = 255
+
+def base_categories(codes, detected):
+    # Category code of every detected pixel before staircase propagation, NO_ERROR elsewhere.
+    bad_codes = bad_neighbour_codes(codes, detected != 0)
+    categories = CATEGORY_LUT[codes.astype(np.uint16) | (bad_codes.astype(np.uint16) << 8)]
+    categories[detected == 2] = CATEGORY_CODES["CL"]
+    categories[detected == 0] = NO_ERROR
+    return categories
+
+def propagate_staircases(categories, seeds):
+    # Every non-CL error 8-connected to a staircase pixel becomes a staircase.
+    # Returns the final category code of each error in the components reached from seeds.
+    h, w = categories.shape
+    sc, cl = CATEGORY_CODES["SC"], CATEGORY_CODES["CL"]
+    final = {}
+    for seed in seeds:
+        if seed in final:
+            continue
+        component = [seed]
+        final[seed] = None
+        has_sc = False
+        for y, x in component:
+            if categories[y, x] == sc:
+                has_sc = True
+            for dy, dx in NEIGHBOUR_OFFSETS:
+                pos = (y + dy, x + dx)
+                if 0 <= pos[0] < h and 0 <= pos[1] < w and pos not in final and categories[pos] < cl:
+                    final[pos] = None
+                    component.append(pos)
+        for pos in component:
+            final[pos] = sc if has_sc else int(categories[pos])
+    return final
+
+def union_roots(n, u, v):
+    # Root (smallest node) of every node 0..n-1 of the graph with edges u[i] - v[i].
+    # Union-find over all edges at once: roots are hooked onto the smaller root of each
+    # edge, then every pointer is jumped to its root, until no edge joins two roots.
+    parent = np.arange(n, dtype=np.int32)
+    while u.size:
+        pu, pv = parent[u], parent[v]
+        joined = pu != pv
+        u, v, pu, pv = u[joined], v[joined], pu[joined], pv[joined]
+        if not u.size:
+            break
+        parent[np.maximum(pu, pv)] = np.minimum(pu, pv)
+        while True:
+            grand = parent[parent]
+            if np.array_equal(grand, parent):
+                break
+            parent = grand
+    return parent
+
+def label_components(mask):
+    # 8-connected components of a boolean mask: the label of a pixel is the smallest
+    # mask-pixel index (row-major, counted over mask pixels only) of its component, -1 off the mask.
+    h, w = mask.shape
+    node = np.full((h, w), -1, dtype=np.int32)
+    n = int(np.count_nonzero(mask))
+    node[mask] = np.arange(n, dtype=np.int32)
+    pairs = [(node[:, :-1], node[:, 1:]), (node[:-1, :], node[1:, :]),
+             (node[:-1, :-1], node[1:, 1:]), (node[:-1, 1:], node[1:, :-1])]
+    u = np.concatenate([a[(a >= 0) & (b >= 0)] for a, b in pairs])
+    v = np.concatenate([b[(a >= 0) & (b >= 0)] for a, b in pairs])
+    labels = np.full((h, w), -1, dtype=np.int32)
+    labels[mask] = union_roots(n, u, v)
+    return labels
+
+def promote_staircases(categories):
+    # Category plane after staircase propagation: every non-CL error 8-connected to a
+    # staircase pixel becomes a staircase.
+    sc, cl = CATEGORY_CODES["SC"], CATEGORY_CODES["CL"]
+    labels = label_components(categories < cl)
+    has_sc = np.zeros(int(np.count_nonzero(categories < cl)), dtype=bool)
+    has_sc[labels[categories == sc]] = True
+    final = categories.copy()
+    final[(labels >= 0) & has_sc[labels]] = sc
+    return final
+
+def outline_mask(img_np, y0=0, y1=None, x0=0, x1=None):
+    # Opaque pixels of img_np[y0:y1, x0:x1] with a transparent 4-neighbour (or the image edge).
+    h, w, _ = img_np.shape
+    y1 = h if y1 is None else y1
+    x1 = w if x1 is None else x1
+    trans = np.ones((y1 - y0 + 2, x1 - x0 + 2), dtype=bool)
+    hy0, hy1, hx0, hx1 = halo_window(img_np.shape, y0, y1, x0, x1)
+    trans[hy0 - y0 + 1:hy1 - y0 + 1, hx0 - x0 + 1:hx1 - x0 + 1] = img_np[hy0:hy1, hx0:hx1, 3] == 0
+    has_trans_neighbor = trans[:-2, 1:-1] | trans[2:, 1:-1] | trans[1:-1, :-2] | trans[1:-1, 2:]
+    return (img_np[y0:y1, x0:x1, 3] > 0) & has_trans_neighbor
+
+def halo_window(shape, y0, y1, x0, x1, margin=1):
+    h, w = shape[:2]
+    return max(y0 - margin, 0), min(y1 + margin, h), max(x0 - margin, 0), min(x1 + margin, w)
+
+def dilate(mask):
+    out = mask.copy()
+    out[1:] |= mask[:-1]
+    out[:-1] |= mask[1:]
+    vertical = out.copy()
+    out[:, 1:] |= vertical[:, :-1]
+    out[:, :-1] |= vertical[:, 1:]
+    return out
+
+def points_in_polygon(xs, ys, polygon):
+    # Even-odd test of the points (xs, ys) against polygon [(x, y), ...], one vectorized
+    # pass over the points per polygon edge.
+    xs = np.asarray(xs, dtype=np.float64)
+    ys = np.asarray(ys, dtype=np.float64)
+    inside = np.zeros(len(xs), dtype=bool)
+    corners = np.asarray(polygon, dtype=np.float64).reshape(-1, 2)
+    for (ax, ay), (bx, by) in zip(corners.tolist(), np.roll(corners, -1, axis=0).tolist()):
+        crossing = np.flatnonzero((ay > ys) != (by > ys))
+        inside[crossing] ^= xs[crossing] < ax + (ys[crossing] - ay) * (bx - ax) / (by - ay)
+    return inside
+
+CATEGORY_NAMES = {"OT": "Outlines Touching", "SC": "Staircase", "OSC": "Optional Staircase", "CR": "Corner", "CL": "Cluster"}
+CATEGORY_COLORS = {"CL": (115, 0, 115), "SC": (255, 0, 0), "OSC": (255, 155, 0), "OT": (255, 0, 200), "CR": (255, 255, 0)}
+
+class AnalysisCancelled(Exception):
+    pass
+
+class Profiler:
+    # Call counts, total/max wall time and a histogram of durations for named phases, plus
+    # the most recent max_events phases as Chrome trace events (chrome://tracing, Perfetto).
+    # Histogram bucket i counts durations of less than 2**i microseconds (and at least half
+    # that). While disabled, phase() returns a shared no-op context manager.
+    BUCKETS = 32
+
+    def __init__(self, enabled=False, max_events=200000):
+        self.enabled = enabled
+        self.max_events = max_events
+        self.lock = threading.Lock()
+        self.origin = time.perf_counter_ns()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.stats = {}
+            self.events = deque(maxlen=self.max_events)
+
+    def phase(self, name):
+        if not self.enabled:
+            return _NO_PHASE
+        return self._timed(name)
+
+    @contextlib.contextmanager
+    def _timed(self, name):
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            self.add(name, start, time.perf_counter_ns())
+
+    def add(self, name, start_ns, end_ns):
+        micros = (end_ns - start_ns) // 1000
+        bucket = min(int(micros).bit_length(), self.BUCKETS - 1)
+        with self.lock:
+            stat = self.stats.get(name)
+            if stat is None:
+                stat = self.stats[name] = {"count": 0, "total_us": 0, "max_us": 0, "last_us": 0,
+                                           "histogram": [0] * self.BUCKETS}
+            stat["count"] += 1
+            stat["total_us"] += micros
+            stat["max_us"] = max(stat["max_us"], micros)
+            stat["last_us"] = micros
+            stat["histogram"][bucket] += 1
+            self.events.append((name, (start_ns - self.origin) // 1000, micros, threading.get_ident()))
+
+    def summary(self):
+        with self.lock:
+            return {name: dict(stat, histogram=list(stat["histogram"])) for name, stat in self.stats.items()}
+
+    def trace(self):
+        # Chrome trace format: one complete ("X") event per phase, the summary under otherData.
+        pid = os.getpid()
+        with self.lock:
+            events = [{"name": name, "ph": "X", "ts": ts, "dur": dur, "pid": pid, "tid": tid, "cat": "phase"}
+                      for name, ts, dur, tid in self.events]
+        return {"traceEvents": events, "displayTimeUnit": "ms", "otherData": {"phases": self.summary()}}
+
+    def dump(self, path):
+        with open(path, "w") as f:
+            json.dump(self.trace(), f)
+
+_NO_PHASE = contextlib.nullcontext()
+
+# Shared by the core, the GUI and the CLI; OUTLINECHECK_PROFILE=1 enables it from the start.
+PROFILER = Profiler(enabled=os.environ.get("OUTLINECHECK_PROFILE", "") not in ("", "0"))
+
+class ErrorTable:
+    # Errors as parallel arrays indexed by error id, plus a label image holding the id of
+    # the error at every pixel (-1 where there is none). Ids are never reused: removed
+    # errors stay in the arrays with live unset.
+    def __init__(self, shape=(0, 0), palette=None):
+        self.size = 0
+        self._x = np.zeros(0, dtype=np.int32)
+        self._y = np.zeros(0, dtype=np.int32)
+        self._color = np.zeros(0, dtype=np.int32)
+        self._category = np.zeros(0, dtype=np.uint8)
+        self._live = np.zeros(0, dtype=bool)
+        self.colors = palette.colors if palette is not None else []
+        self.label = np.full(shape, -1, dtype=np.int32)
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def x(self):
+        return self._x[:self.size]
+
+    @property
+    def y(self):
+        return self._y[:self.size]
+
+    @property
+    def color_index(self):
+        return self._color[:self.size]
+
+    @property
+    def category(self):
+        return self._category[:self.size]
+
+    @property
+    def live(self):
+        return self._live[:self.size]
+
+    def _reserve(self, n):
+        capacity = len(self._x)
+        if n <= capacity:
+            return
+        capacity = max(n, 2 * capacity, 1024)
+        for name in ("_x", "_y", "_color", "_category", "_live"):
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+
+    def add(self, xs, ys, color_ids, categories):
+        # Appends errors at (xs, ys) with palette colour ids and category codes; returns their ids.
+        n = len(xs)
+        ids = np.arange(self.size, self.size + n)
+        self._reserve(self.size + n)
+        rows = slice(self.size, self.size + n)
+        self._x[rows] = xs
+        self._y[rows] = ys
+        self._color[rows] = color_ids
+        self._category[rows] = categories
+        self._live[rows] = True
+        self.label[ys, xs] = ids
+        self.size += n
+        return ids
+
+    def remove(self, ids):
+        ids = np.asarray(ids, dtype=np.intp)
+        self._live[ids] = False
+        self.label[self._y[ids], self._x[ids]] = -1
+
+    def at(self, x, y):
+        h, w = self.label.shape
+        if 0 <= x < w and 0 <= y < h:
+            return int(self.label[y, x])
+        return -1
+
+    def ids_at(self, xs, ys):
+        # Ids of the errors at the pixels (xs, ys), skipping pixels without one.
+        ids = self.label[ys, xs]
+        return ids[ids >= 0]
+
+    def query(self, x0=0, y0=0, x1=None, y1=None, categories=None, colors=None, polygon=None):
+        # Ids of the live errors in the pixel rectangle [x0, x1) x [y0, y1), restricted to the
+        # given category keys, RGBA colours and polygon [(x, y), ...] (tested at pixel centres).
+        # A rectangle smaller than the table is read from the label image, a larger one by
+        # filtering the coordinate arrays, so the cost follows the smaller of the two.
+        h, w = self.label.shape
+        x0, y0 = max(int(x0), 0), max(int(y0), 0)
+        x1 = w if x1 is None else min(int(x1), w)
+        y1 = h if y1 is None else min(int(y1), h)
+        if x1 <= x0 or y1 <= y0:
+            return np.zeros(0, dtype=np.intp)
+        if (x1 - x0) * (y1 - y0) <= self.size:
+            ids = self.label[y0:y1, x0:x1]
+            ids = ids[ids >= 0].astype(np.intp)
+        else:
+            ids = self.live_ids()
+            xs, ys = self.x[ids], self.y[ids]
+            ids = ids[(xs >= x0) & (xs < x1) & (ys >= y0) & (ys < y1)]
+        if categories is not None:
+            ids = ids[np.isin(self.category[ids], [CATEGORY_CODES[key] for key in categories])]
+        if colors is not None:
+            wanted = {tuple(int(c) for c in color) for color in colors}
+            color_ids = [i for i in np.unique(self.color_index[ids]).tolist() if self.colors[i] in wanted]
+            ids = ids[np.isin(self.color_index[ids], color_ids)]
+        if polygon is not None:
+            ids = ids[points_in_polygon(self.x[ids] + 0.5, self.y[ids] + 0.5, polygon)]
+        return ids
+
+    def copy(self, palette):
+        # Independent table sharing nothing with self; colours come from palette (a copy of self's).
+        table = ErrorTable.__new__(ErrorTable)
+        table.size = self.size
+        for name in ("_x", "_y", "_color", "_category", "_live"):
+            setattr(table, name, getattr(self, name).copy())
+        table.colors = palette.colors
+        table.label = self.label.copy()
+        return table
+
+    def live_ids(self):
+        return np.flatnonzero(self.live)
+
+    def color_of(self, lid):
+        return self.colors[self._color[lid]]
+
+    def category_of(self, lid):
+        return CATEGORY_KEYS[self._category[lid]]
+
+    def memory_report(self):
+        table = sum(getattr(self, name).nbytes for name in ("_x", "_y", "_color", "_category", "_live"))
+        return {"errors": int(np.count_nonzero(self.live)), "ids": self.size,
+                "table_bytes": table, "label_bytes": self.label.nbytes}
+
+class PixelHistory:
+    # Undo history stored as sparse pixel deltas: delta i turns state i into state i + 1.
+    # The oldest deltas are dropped once max_bytes is exceeded.
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.reset()
+
+    def reset(self):
+        self.deltas = []
+        self.first = 0
+        self.index = 0
+        self.nbytes = 0
+
+    def __len__(self):
+        return len(self.deltas)
+
+    def record(self, xs, ys, old, new):
+        for delta in self.deltas[self.index - self.first:]:
+            self.nbytes -= sum(a.nbytes for a in delta)
+        del self.deltas[self.index - self.first:]
+
+        coords = np.stack([np.asarray(xs), np.asarray(ys)], axis=1)
+        coords = coords.astype(np.uint16 if coords.size == 0 or coords.max() < 1 << 16 else np.int32)
+        delta = (coords, np.asarray(old, dtype=np.uint8).reshape(-1, 4), np.asarray(new, dtype=np.uint8).reshape(-1, 4))
+        self.deltas.append(delta)
+        self.nbytes += sum(a.nbytes for a in delta)
+        self.index += 1
+
+        while self.nbytes > self.max_bytes and self.first < self.index:
+            self.nbytes -= sum(a.nbytes for a in self.deltas.pop(0))
+            self.first += 1
+
+    def undo(self):
+        if self.index <= self.first:
+            return None
+        self.index -= 1
+        coords, old, _ = self.deltas[self.index - self.first]
+        return coords[:, 0], coords[:, 1], old
+
+    def redo(self):
+        if self.index - self.first >= len(self.deltas):
+            return None
+        coords, _, new = self.deltas[self.index - self.first]
+        self.index += 1
+        return coords[:, 0], coords[:, 1], new
+
+def analyze_cell(crop, core):
+    # Errors of the core window (y0, y1, x0, x1) of crop, a tile plus its halo, from its
+    # pixels alone: local xs, ys, packed colours and base categories, tile-local staircase
+    # component labels with has_sc per component, whether each error lies on the tile edge,
+    # and the packed outline colours with their counts.
+    cy0, cy1, cx0, cx1 = core
+    keys = pack_rgba(crop)
+    codes = neighbour_codes(keys)
+    categories = base_categories(codes, detection_plane(crop, codes))[cy0:cy1, cx0:cx1]
+
+    non_cl = categories < CATEGORY_CODES["CL"]
+    labels = label_components(non_cl)
+    has_sc = np.zeros(int(np.count_nonzero(non_cl)), dtype=bool)
+    has_sc[labels[categories == CATEGORY_CODES["SC"]]] = True
+    ys, xs = np.nonzero(categories != NO_ERROR)
+    border = non_cl[ys, xs] & ((ys == 0) | (ys == cy1 - cy0 - 1) | (xs == 0) | (xs == cx1 - cx0 - 1))
+    core_keys = keys[cy0:cy1, cx0:cx1]
+    outline_colors, outline_counts = np.unique(core_keys[outline_mask(crop, cy0, cy1, cx0, cx1)], return_counts=True)
+    return (xs, ys, core_keys[ys, xs], categories[ys, xs], labels[ys, xs], has_sc, border,
+            outline_colors, outline_counts)
+
+class CellCache:
+    # analyze_cell() results keyed by a hash of the cell, its halo and its position inside
+    # them: edited cells are the only ones analyzed again and identical cells share one
+    # result. Shared by the tile threads; the least recently used results beyond max_entries are dropped.
+    def __init__(self, max_entries=16384):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def analyze(self, crop, core):
+        digest = hashlib.blake2b(np.ascontiguousarray(crop), digest_size=16)
+        digest.update(f"{crop.shape}/{core}/{CACHE_VERSION}".encode())
+        key = digest.digest()
+        with self.lock:
+            result = self.entries.get(key)
+            if result is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return result
+        result = analyze_cell(crop, core)
+        with self.lock:
+            self.misses += 1
+            self.entries[key] = result
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return result
+
+# Images above AUTO_TILE_PIXELS are analyzed in TILE_SIZE tiles unless a tile size is given.
+TILE_SIZE = 1024
+AUTO_TILE_PIXELS = 4096 * 4096
+
+# fix_all() passes: at most FIX_ALL_ITERATIONS by default; passes painting more than
+# INCREMENTAL_FIX_LIMIT pixels re-analyze in full instead of going through update().
+FIX_ALL_ITERATIONS = 16
+INCREMENTAL_FIX_LIMIT = 4096
+
+class OutlineAnalysis:
+    # Errors of one RGBA image (h, w, 4 uint8), without any Qt dependency.
+    def __init__(self):
+        self.img_np = None
+        self.palette = None
+        self.errors = ErrorTable()
+        self.outline_colors = set()
+        self.outline_counts = {}
+        self.base_categories = None
+
+    @staticmethod
+    def tile_size_for(shape, tile_size=None, cell_cache=None):
+        # Tile size analyze() uses for an image of this shape, None when it is analyzed whole.
+        h, w = shape[:2]
+        if tile_size is None and h * w > AUTO_TILE_PIXELS:
+            tile_size = TILE_SIZE
+        if cell_cache is not None or (tile_size is not None and (h > tile_size or w > tile_size)):
+            return tile_size
+        return None
+
+    def analyze(self, img_np, progress=None, tile_size=None, workers=None, cell_cache=None, palette=None):
+        # progress(fraction) is called between phases; it may raise AnalysisCancelled to stop early.
+        # With a cell_cache, tile_size is the sprite-sheet cell size, see analyze_tiled().
+        # palette may pass the PaletteImage of img_np when the caller already built it.
+        h, w, _ = img_np.shape
+        tile_size = self.tile_size_for(img_np.shape, tile_size, cell_cache)
+        if tile_size is not None:
+            return self.analyze_tiled(img_np, tile_size, workers, progress, cell_cache)
+        report = progress or (lambda fraction: None)
+        self.img_np = img_np
+
+        report(0.0)
+        with PROFILER.phase("palette"):
+            if palette is None:
+                palette = PaletteImage(img_np)
+            self.palette = palette
+            self.errors = ErrorTable((h, w), palette)
+            out_counts = np.bincount(palette.index[outline_mask(img_np)], minlength=len(palette))
+            self.outline_counts = {palette.colors[i]: int(out_counts[i]) for i in np.flatnonzero(out_counts).tolist()}
+            self.outline_colors = set(self.outline_counts)
+        report(0.1)
+        with PROFILER.phase("pattern_scan"):
+            codes = neighbour_codes(palette.index)
+            report(0.3)
+            xs, ys, is_cluster = detect_errors(img_np, palette.index, codes)
+        report(0.5)
+        categories = np.where(is_cluster, CATEGORY_CODES["CL"], CATEGORY_CODES["OT"])
+        self.errors.add(xs, ys, palette.index[ys, xs], categories)
+
+        report(0.8)
+        with PROFILER.phase("categorize"):
+            self.categorize_errors(img_np, self.errors.label >= 0, codes)
+        report(1.0)
+        return self
+
+    def analyze_tiled(self, img_np, tile_size=TILE_SIZE, workers=None, progress=None, cell_cache=None):
+        # Same result as analyze(), but every per-pixel temporary covers one tile plus a
+        # 2-pixel halo: categories read the detection of the 3x3 neighbourhood, which reads
+        # the colours of its own 3x3. Tiles run on a thread pool (the work is NumPy, which
+        # releases the GIL, and threads share img_np without copies). Staircase components
+        # are labelled inside each tile, then joined across tile borders.
+        # tile_size is an int or (height, width). Sprite sheets pass their cell size and a
+        # CellCache, so unchanged and duplicated cells reuse one analyze_cell() result.
+        report = progress or (lambda fraction: None)
+        h, w, _ = img_np.shape
+        self.img_np = img_np
+        th, tw = (tile_size, tile_size) if np.isscalar(tile_size) else tile_size
+        windows = [(y, min(y + th, h), x, min(x + tw, w)) for y in range(0, h, th) for x in range(0, w, tw)]
+
+        report(0.0)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            with PROFILER.phase("palette"):
+                tile_keys = pool.map(lambda win: np.unique(pack_rgba(img_np[win[0]:win[1], win[2]:win[3]])), windows)
+                keys = np.unique(np.concatenate(list(tile_keys)))
+                self.palette = palette = PaletteImage.from_keys(keys, (h, w))
+                self.base_categories = np.full((h, w), NO_ERROR, dtype=np.uint8)
+            report(0.1)
+            tiles = [None] * len(windows)
+            futures = {pool.submit(self._analyze_tile, window, keys, cell_cache): i for i, window in enumerate(windows)}
+            try:
+                for done, future in enumerate(as_completed(futures)):
+                    tiles[futures[future]] = future.result()
+                    report(0.1 + 0.7 * (done + 1) / len(windows))
+            except AnalysisCancelled:
+                for future in futures:
+                    future.cancel()
+                raise
+
+        with PROFILER.phase("stitch"):
+            xs, ys, color_ids, categories, components, has_sc, border, outline_ids, outline_counts = (
+                np.concatenate(parts) for parts in zip(*tiles))
+            out_counts = np.zeros(len(palette), dtype=np.int64)
+            np.add.at(out_counts, outline_ids, outline_counts)
+            self.outline_counts = {palette.colors[i]: int(out_counts[i]) for i in np.flatnonzero(out_counts).tolist()}
+            self.outline_colors = set(self.outline_counts)
+
+            # Tile-local component labels become global ids; components meeting across a tile
+            # border are joined through the errors lying on the tile edges.
+            offsets = np.cumsum([0] + [len(tile[5]) for tile in tiles[:-1]])
+            sizes = [len(tile[0]) for tile in tiles]
+            components = np.where(components >= 0, components + np.repeat(offsets, sizes), -1)
+            raster = ys.astype(np.int64) * w + xs
+            edge_nodes = np.flatnonzero(border)
+            edge_nodes = edge_nodes[np.argsort(raster[edge_nodes])]
+            edge_keys = raster[edge_nodes]
+            u, v = [], []
+            for dy, dx in ((0, 1), (1, -1), (1, 0), (1, 1)):
+                target = edge_keys + dy * w + dx
+                pos = np.minimum(np.searchsorted(edge_keys, target), max(len(edge_keys) - 1, 0))
+                nx = xs[edge_nodes] + dx
+                hit = (nx >= 0) & (nx < w) & (edge_keys[pos] == target) if len(edge_keys) else np.zeros(0, dtype=bool)
+                u.append(components[edge_nodes[hit]])
+                v.append(components[edge_nodes[pos[hit]]])
+            roots = union_roots(len(has_sc), np.concatenate(u), np.concatenate(v))
+            sc_roots = np.zeros(len(has_sc), dtype=bool)
+            sc_roots[roots[has_sc]] = True
+            promoted = components >= 0
+            promoted[promoted] = sc_roots[roots[components[promoted]]]
+            categories[promoted] = CATEGORY_CODES["SC"]
+        report(0.9)
+
+        # Error ids in the order of the untiled scan: colours by first appearance, then row-major.
+        by_raster = np.argsort(raster)
+        _, first_idx, inverse = np.unique(color_ids[by_raster], return_index=True, return_inverse=True)
+        rank = np.argsort(np.argsort(first_idx))
+        order = by_raster[np.argsort(rank[inverse.reshape(-1)], kind="stable")]
+        self.errors = ErrorTable((h, w), palette)
+        self.errors.add(xs[order], ys[order], color_ids[order], categories[order])
+        report(1.0)
+        return self
+
+    def _analyze_tile(self, window, keys, cell_cache=None):
+        # Fills the palette index and base categories of one tile and returns its errors,
+        # tile-local staircase components and outline colour counts in image coordinates.
+        ty0, ty1, tx0, tx1 = window
+        img_np = self.img_np
+        hy0, hy1, hx0, hx1 = halo_window(img_np.shape, ty0, ty1, tx0, tx1, margin=2)
+        crop = img_np[hy0:hy1, hx0:hx1]
+        core = (ty0 - hy0, ty1 - hy0, tx0 - hx0, tx1 - hx0)
+        with PROFILER.phase("tile"):
+            result = analyze_cell(crop, core) if cell_cache is None else cell_cache.analyze(crop, core)
+        xs, ys, colors, categories, labels, has_sc, border, outline_colors, outline_counts = result
+
+        self.palette.index[ty0:ty1, tx0:tx1] = np.searchsorted(keys, pack_rgba(img_np[ty0:ty1, tx0:tx1]))
+        base = np.full((ty1 - ty0, tx1 - tx0), NO_ERROR, dtype=np.uint8)
+        base[ys, xs] = categories
+        self.base_categories[ty0:ty1, tx0:tx1] = base
+        return (xs + tx0, ys + ty0, np.searchsorted(keys, colors), categories, labels, has_sc, border,
+                np.searchsorted(keys, outline_colors), outline_counts)
+
+    def copy(self):
+        analysis = OutlineAnalysis()
+        analysis.img_np = self.img_np.copy()
+        analysis.palette = self.palette.copy()
+        analysis.errors = self.errors.copy(analysis.palette)
+        analysis.outline_colors = set(self.outline_colors)
+        analysis.outline_counts = dict(self.outline_counts)
+        analysis.base_categories = self.base_categories.copy()
+        return analysis
+
+    def snapshot(self):
+        # Compact arrays (live errors in id order) from which restore() rebuilds this analysis
+        # without detecting anything again. Colours are stored as their rank of first
+        # appearance, so the record also fits any recolouring with the same structure_key().
+        errors = self.errors
+        palette = self.palette
+        live = errors.live_ids()
+        xs, ys = errors.x[live], errors.y[live]
+        rank = np.empty(len(palette), dtype=np.int64)
+        rank[palette.first_appearance()] = np.arange(len(palette))
+        outline = pack_rgba(np.array(list(self.outline_counts), dtype=np.uint8).reshape(-1, 4))
+        return {
+            "palette": np.unique(np.array(list(palette.color_ids), dtype=np.uint32)),
+            "x": xs, "y": ys,
+            "color": rank[errors.color_index[live]],
+            "category": errors.category[live],
+            "base": self.base_categories[ys, xs],
+            "outline_colors": rank[[palette.color_ids[key] for key in outline.tolist()]],
+            "outline_counts": np.array(list(self.outline_counts.values()), dtype=np.int64),
+        }
+
+    def restore(self, img_np, record, palette=None):
+        # palette is the PaletteImage of img_np; without one it is rebuilt from the record's colours,
+        # which are those of img_np when the record was stored for these exact pixels.
+        h, w, _ = img_np.shape
+        if palette is None:
+            keys = record["palette"]
+            palette = PaletteImage.from_keys(keys, (h, w))
+            palette.index[:] = np.searchsorted(keys, pack_rgba(img_np))
+        self.img_np = img_np
+        self.palette = palette
+        color_ids = palette.first_appearance()
+        xs, ys = record["x"], record["y"]
+        self.errors = ErrorTable((h, w), palette)
+        self.errors.add(xs, ys, color_ids[record["color"]], record["category"])
+        self.base_categories = np.full((h, w), NO_ERROR, dtype=np.uint8)
+        self.base_categories[ys, xs] = record["base"]
+        outline_ids = color_ids[record["outline_colors"]].tolist()
+        self.outline_counts = {palette.colors[i]: n for i, n in zip(outline_ids, record["outline_counts"].tolist())}
+        self.outline_colors = set(self.outline_counts)
+        return self
+
+    def categorize_errors(self, img_np, bad_pixel_mask, codes=None):
+        h, w, _ = img_np.shape
+        if codes is None:
+            codes = neighbour_codes(self.palette.index)
+        bad_codes = bad_neighbour_codes(codes, bad_pixel_mask)
+        errors = self.errors
+        category = errors.category
+        cl = CATEGORY_CODES["CL"]
+
+        self.base_categories = np.full((h, w), NO_ERROR, dtype=np.uint8)
+        clusters = category == cl
+        self.base_categories[errors.y[clusters], errors.x[clusters]] = cl
+
+        others = np.flatnonzero(~clusters)
+        if others.size:
+            xs, ys = errors.x[others], errors.y[others]
+            lut_index = codes[ys, xs].astype(np.uint16) | (bad_codes[ys, xs].astype(np.uint16) << 8)
+            category_codes = CATEGORY_LUT[lut_index]
+            on_border = (ys < 1) | (ys >= h - 1) | (xs < 1) | (xs >= w - 1)
+            category_codes[on_border] = CATEGORY_CODES["CR"]
+            self.base_categories[ys, xs] = category_codes
+            category[others] = promote_staircases(self.base_categories)[ys, xs]
+
+    def update(self, edits):
+        with PROFILER.phase("incremental_update"):
+            return self._update(edits)
+
+    def _update(self, edits):
+        # Writes edits [(x, y, rgba)] into img_np and re-evaluates only their neighbourhood,
+        # patching the error table in place. Returns the (added, removed, changed) error ids.
+        img_np = self.img_np
+        palette = self.palette
+        errors = self.errors
+        xs = [x for x, _, _ in edits]
+        ys = [y for _, y, _ in edits]
+        y0, y1, x0, x1 = min(ys), max(ys) + 1, min(xs), max(xs) + 1
+
+        # Detection reads the 3x3 window of a pixel and categories read the detection of
+        # the 3x3 window, so edits reach 2 pixels; staircase components are followed from 3.
+        dy0, dy1, dx0, dx1 = halo_window(img_np.shape, y0, y1, x0, x1)
+        cy0, cy1, cx0, cx1 = halo_window(img_np.shape, dy0, dy1, dx0, dx1)
+        ky0, ky1, kx0, kx1 = halo_window(img_np.shape, cy0, cy1, cx0, cx1)
+        edit_mask = np.zeros((ky1 - ky0, kx1 - kx0), dtype=bool)
+        edit_mask[np.array(ys) - ky0, np.array(xs) - kx0] = True
+        det_mask = dilate(edit_mask)
+        seed_mask = dilate(dilate(det_mask))
+
+        self._count_outline_colors(ky0, ky1, kx0, kx1, det_mask, -1)
+        for x, y, color in edits:
+            img_np[y, x] = color
+        palette.set_pixels(xs, ys, [color for _, _, color in edits])
+        self._count_outline_colors(ky0, ky1, kx0, kx1, det_mask, 1)
+
+        crop = img_np[ky0:ky1, kx0:kx1]
+        codes = neighbour_codes(palette.index[ky0:ky1, kx0:kx1])
+        known = self.base_categories[ky0:ky1, kx0:kx1]
+        detected = np.where(known == CATEGORY_CODES["CL"], 2, known != NO_ERROR).astype(np.uint8)
+        det_inner = (slice(dy0 - ky0, dy1 - ky0), slice(dx0 - kx0, dx1 - kx0))
+        detected[det_inner] = detection_plane(crop, codes)[det_inner]
+        categories = base_categories(codes, detected)
+        self.base_categories[cy0:cy1, cx0:cx1] = categories[cy0 - ky0:cy1 - ky0, cx0 - kx0:cx1 - kx0]
+
+        seeds = np.argwhere(seed_mask & (self.base_categories[ky0:ky1, kx0:kx1] < CATEGORY_CODES["CL"]))
+        final = propagate_staircases(self.base_categories, [(int(y) + ky0, int(x) + kx0) for y, x in seeds])
+        for y, x in np.argwhere(det_mask).tolist():
+            pos = (y + ky0, x + kx0)
+            if pos not in final:
+                final[pos] = int(self.base_categories[pos])
+
+        removed, changed = [], []
+        new_xs, new_ys, new_codes = [], [], []
+        for (y, x), code in final.items():
+            lid = int(errors.label[y, x])
+            if lid < 0 and code == NO_ERROR:
+                continue
+            if lid >= 0 and (code == NO_ERROR or errors.color_index[lid] != palette.index[y, x]):
+                removed.append(lid)
+                lid = -1
+            if code == NO_ERROR:
+                continue
+            if lid < 0:
+                new_xs.append(x)
+                new_ys.append(y)
+                new_codes.append(code)
+            elif errors.category[lid] != code:
+                errors.category[lid] = code
+                changed.append(lid)
+
+        if removed:
+            errors.remove(removed)
+        added = []
+        if new_xs:
+            new_xs, new_ys = np.array(new_xs), np.array(new_ys)
+            added = errors.add(new_xs, new_ys, palette.index[new_ys, new_xs], new_codes).tolist()
+        return added, removed, changed
+
+    def _count_outline_colors(self, y0, y1, x0, x1, mask, sign):
+        window = self.palette.index[y0:y1, x0:x1]
+        color_ids, counts = np.unique(window[outline_mask(self.img_np, y0, y1, x0, x1) & mask], return_counts=True)
+        for color_id, n in zip(color_ids.tolist(), counts.tolist()):
+            color_tuple = self.palette.colors[color_id]
+            count = self.outline_counts.get(color_tuple, 0) + sign * n
+            if count > 0:
+                self.outline_counts[color_tuple] = count
+                self.outline_colors.add(color_tuple)
+            else:
+                self.outline_counts.pop(color_tuple, None)
+                self.outline_colors.discard(color_tuple)
+
+    def fix_edits(self, layer_ids, fill_color):
+        # Pixel edits [(x, y, old_rgba, new_rgba)] that paint the given errors with fill_color.
+        fill_color = tuple(int(c) for c in fill_color)
+        ids = np.asarray(layer_ids, dtype=np.intp)
+        xs, ys = self.errors.x[ids], self.errors.y[ids]
+        old = self.img_np[ys, xs]
+        keep = np.any(old != np.array(fill_color, dtype=np.uint8), axis=-1)
+        return [(x, y, tuple(o), fill_color)
+                for x, y, o in zip(xs[keep].tolist(), ys[keep].tolist(), old[keep].tolist())]
+
+    def fix_all(self, categories=CATEGORY_KEYS, fill_color=(0, 0, 0, 0), max_iterations=FIX_ALL_ITERATIONS,
+                progress=None, **kwargs):
+        # Paints every error of the given categories with fill_color and re-evaluates, pass
+        # after pass, until none is left or max_iterations passes ran: fixing pixels can turn
+        # their neighbours into errors. kwargs are those of analyze(), for full re-analyses.
+        # Returns the net edits (xs, ys, old, new) as arrays and a report of the passes.
+        # progress(fraction) works as in analyze(); each pass takes half of what is left.
+        start = time.perf_counter()
+        report = progress or (lambda fraction: None)
+        fill_color = tuple(int(c) for c in fill_color)
+        fill = np.array(fill_color, dtype=np.uint8)
+        codes = [CATEGORY_CODES[key] for key in categories]
+        before = self.img_np.copy()
+        passes = []
+        while len(passes) < max_iterations:
+            done = 1 - 0.5 ** len(passes)
+            report(done)
+            live = self.errors.live_ids()
+            ids = live[np.isin(self.errors.category[live], codes)]
+            xs, ys = self.errors.x[ids], self.errors.y[ids]
+            # Errors already painted with the fill colour cannot be fixed by painting again.
+            keep = np.any(self.img_np[ys, xs] != fill, axis=-1)
+            xs, ys = xs[keep], ys[keep]
+            if not len(xs):
+                break
+            pass_start = time.perf_counter()
+            with PROFILER.phase("fix_pass"):
+                if len(xs) <= INCREMENTAL_FIX_LIMIT:
+                    self.update([(x, y, fill_color) for x, y in zip(xs.tolist(), ys.tolist())])
+                else:
+                    self.img_np[ys, xs] = fill
+                    self.analyze(self.img_np, lambda fraction: report(done + fraction * (1 - done) / 2), **kwargs)
+            passes.append({"pixels": len(xs), "seconds": time.perf_counter() - pass_start})
+
+        ys, xs = np.nonzero(np.any(before != self.img_np, axis=-1))
+        counts = self.category_counts()
+        remaining = sum(counts[key] for key in categories)
+        report = {
+            "iterations": len(passes), "pixels": len(xs), "remaining": remaining, "converged": remaining == 0,
+            "seconds": time.perf_counter() - start, "passes": passes, "counts": counts,
+        }
+        return (xs, ys, before[ys, xs], self.img_np[ys, xs]), report
+
+    def category_counts(self):
+        counts = np.bincount(self.errors.category[self.errors.live], minlength=len(CATEGORY_KEYS))
+        return {key: int(n) for key, n in zip(CATEGORY_KEYS, counts)}
+
+# Part of every cache key; bump it whenever detection or categorization results or the record format change.
+CACHE_VERSION = 2
+
+# Arrays of an OutlineAnalysis.snapshot() record, as stored in the cache files.
+RECORD_FIELDS = ("palette", "x", "y", "color", "category", "base", "outline_colors", "outline_counts")
+
+def default_cache_dir():
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "OutlineCheck")
+
+class AnalysisCache:
+    # Analyses keyed by a hash of the image structure (or of the RGBA buffer for tiled
+    # analyses). Snapshots are kept in an in-memory LRU of max_bytes and, when cache_dir is
+    # set, in .npz files there (oldest removed beyond max_disk_bytes).
+    def __init__(self, max_bytes=128 * 1024 * 1024, cache_dir=None, max_disk_bytes=1024 * 1024 * 1024,
+                 max_aliases=4096):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.max_aliases = max_aliases
+        self.entries = OrderedDict()
+        # Buffer hash -> (structure key, sorted palette keys) of images seen before, so that
+        # exact repeats skip rebuilding the palette.
+        self.aliases = OrderedDict()
+        self.nbytes = 0
+        # Size of the .npz files in cache_dir, scanned when first needed and then kept up to
+        # date by _save(); files written by other processes are only counted by the next scan.
+        self.disk_bytes = None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def key(self, img_np):
+        digest = hashlib.blake2b(np.ascontiguousarray(img_np), digest_size=16)
+        digest.update(f"{img_np.shape}/{CACHE_VERSION}".encode())
+        return digest.hexdigest()
+
+    def structure_key(self, palette):
+        # Hash of the index plane with every colour replaced by its rank of first appearance,
+        # plus which of those colours are transparent or nearly so: the patterns only compare
+        # colours for equality and read alpha, so palette swaps of a sprite share the key.
+        order = palette.first_appearance()
+        rank = np.empty(len(palette), dtype=palette.index.dtype)
+        rank[order] = np.arange(len(palette))
+        alpha = np.array([palette.colors[i][3] for i in order.tolist()], dtype=np.uint8)
+        digest = hashlib.blake2b(np.ascontiguousarray(rank[palette.index]), digest_size=16)
+        digest.update(np.digitize(alpha, [1, 10]).astype(np.uint8).tobytes())
+        digest.update(f"structure/{palette.index.shape}/{CACHE_VERSION}".encode())
+        return digest.hexdigest()
+
+    def get(self, img_np, key=None, palette=None):
+        key = key or self.key(img_np)
+        record = self.entries.get(key)
+        if record is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+        else:
+            record = self._load(key)
+            if record is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._remember(key, record)
+        return OutlineAnalysis().restore(img_np, record, palette)
+
+    def put(self, analysis, key=None):
+        key = key or self.key(analysis.img_np)
+        record = analysis.snapshot()
+        self._remember(key, record)
+        self._save(key, record)
+
+    def analyze(self, img_np, progress=None, **kwargs):
+        # Cached OutlineAnalysis of img_np, analyzing (and storing) it on a miss. Images
+        # analyzed whole are looked up by structure_key(), so a palette swap of a cached
+        # image only has its colours remapped.
+        if progress:
+            # Lets a cancelled request stop before the content is hashed.
+            progress(0.0)
+        tile_size = OutlineAnalysis.tile_size_for(img_np.shape, kwargs.get("tile_size"), kwargs.get("cell_cache"))
+        if tile_size is not None:
+            key = self.key(img_np)
+            analysis = self.get(img_np, key)
+            if analysis is None:
+                analysis = OutlineAnalysis().analyze(img_np, progress, **kwargs)
+                self.put(analysis, key)
+            return analysis
+
+        content_key = self.key(img_np)
+        alias = self.aliases.get(content_key)
+        if alias is not None:
+            self.aliases.move_to_end(content_key)
+            key, keys = alias
+            palette = PaletteImage.from_keys(keys, img_np.shape[:2])
+            palette.index[:] = np.searchsorted(keys, pack_rgba(img_np))
+        else:
+            palette = PaletteImage(img_np)
+            key = self.structure_key(palette)
+            self.aliases[content_key] = (key, np.unique(np.array(list(palette.color_ids), dtype=np.uint32)))
+            if len(self.aliases) > self.max_aliases:
+                self.aliases.popitem(last=False)
+        analysis = self.get(img_np, key, palette)
+        if analysis is None:
+            analysis = OutlineAnalysis().analyze(img_np, progress, palette=palette, **kwargs)
+            self.put(analysis, key)
+        return analysis
+
+    def stats(self):
+        return {"hits": self.hits, "disk_hits": self.disk_hits, "misses": self.misses,
+                "entries": len(self.entries), "bytes": self.nbytes}
+
+    def _remember(self, key, record):
+        if key in self.entries:
+            self.nbytes -= sum(a.nbytes for a in self.entries.pop(key).values())
+        self.entries[key] = record
+        self.nbytes += sum(a.nbytes for a in record.values())
+        while self.nbytes > self.max_bytes and len(self.entries) > 1:
+            _, old = self.entries.popitem(last=False)
+            self.nbytes -= sum(a.nbytes for a in old.values())
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + ".npz")
+
+    def _load(self, key):
+        if not self.cache_dir:
+            return None
+        path = self._path(key)
+        try:
+            with np.load(path) as data:
+                record = {name: data[name] for name in RECORD_FIELDS}
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, EOFError, KeyError, zipfile.BadZipFile):
+            # Truncated or foreign file: a miss, removed so the analysis is stored again.
+            with contextlib.suppress(OSError):
+                os.remove(path)
+            return None
+        return record
+
+    def _save(self, key, record):
+        if not self.cache_dir:
+            return
+        tmp_path = None
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # Unique per writer: processes sharing cache_dir may store the same key at once.
+            fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=self.cache_dir)
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, **record)
+            size = os.stat(tmp_path).st_size
+            if self.disk_bytes is None:
+                self.disk_bytes = sum(entry_size for _, entry_size, _ in self._disk_files())
+            with contextlib.suppress(OSError):
+                self.disk_bytes -= os.stat(self._path(key)).st_size
+            os.replace(tmp_path, self._path(key))
+            tmp_path = None
+            self.disk_bytes += size
+            if self.disk_bytes > self.max_disk_bytes:
+                self._trim_disk()
+        except OSError:
+            pass
+        finally:
+            if tmp_path is not None:
+                with contextlib.suppress(OSError):
+                    os.remove(tmp_path)
+
+    def _disk_files(self):
+        # (mtime, size, path) of the .npz files in cache_dir, one stat each.
+        files = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".npz"):
+                with contextlib.suppress(OSError):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+        return files
+
+    def _trim_disk(self):
+        # Removes the least recently used files down to 90% of max_disk_bytes, so that the
+        # next scan is only needed after a tenth of the budget has been written again.
+        files = sorted(self._disk_files())
+        total = sum(size for _, size, _ in files)
+        for _, size, path in files[:-1]:
+            if total <= self.max_disk_bytes * 0.9:
+                break
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+            total -= size
+        self.disk_bytes = total
+
+# Frames differing from the previous one in more pixels than this are analyzed from scratch.
+FRAME_DELTA_LIMIT = 4096
+
+def load_frames(paths):
+    # RGBA arrays and durations (ms) of every frame in paths: all frames of an animated
+    # GIF/APNG, one frame per still image, in the order given.
+    frames, durations = [], []
+    for path in paths:
+        with Image.open(path) as img:
+            for frame in ImageSequence.Iterator(img):
+                frames.append(np.array(frame.convert("RGBA")))
+                durations.append(int(frame.info.get("duration") or 100))
+    return frames, durations
+
+def frame_delta(prev_np, img_np):
+    # Edits [(x, y, rgba)] turning prev_np into img_np.
+    ys, xs = np.nonzero(np.any(prev_np != img_np, axis=-1))
+    return [(x, y, tuple(color)) for x, y, color in zip(xs.tolist(), ys.tolist(), img_np[ys, xs].tolist())]
+
+def analyze_frames(frames, progress=None, cache=None, **kwargs):
+    # One OutlineAnalysis per frame. A frame that changes at most FRAME_DELTA_LIMIT pixels
+    # of the previous one starts from a copy of its analysis and re-evaluates only the
+    # changed neighbourhoods; other frames get a full analysis (through cache if given).
+    report = progress or (lambda fraction: None)
+    analyses = []
+    for i, img_np in enumerate(frames):
+        report(i / len(frames))
+        prev = analyses[-1] if analyses else None
+        if prev is not None and prev.img_np.shape == img_np.shape:
+            changed = np.count_nonzero(np.any(prev.img_np != img_np, axis=-1))
+            if changed <= FRAME_DELTA_LIMIT:
+                analysis = prev.copy()
+                if changed:
+                    analysis.update(frame_delta(prev.img_np, img_np))
+                analyses.append(analysis)
+                continue
+        if cache is not None:
+            analyses.append(cache.analyze(img_np, **kwargs))
+        else:
+            analyses.append(OutlineAnalysis().analyze(img_np, **kwargs))
+    report(1.0)
+    return analyses